@@ -1,21 +1,1413 @@
-from flask import Flask, request, render_template_string, jsonify, session
+from flask import Flask, request, render_template_string, jsonify, session, send_file
 import pandas as pd
 import numpy as np
+import copy
 import io
 import os
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 app = Flask(__name__)
 app.secret_key = 'sr-levels-secret-key-2024'
 
+# Rows per chunk when streaming an upload, and the columns it keeps
+STREAM_CHUNK_ROWS = 100_000
+STREAM_COLUMNS = {'high': 'High', 'h': 'High', 'low': 'Low', 'l': 'Low', 'close': 'Close', 'c': 'Close'}
+
+# Levels per page when strong levels are streamed, and the most one request may ask for
+LEVEL_PAGE_SIZE = 100
+MAX_LEVEL_PAGE = 1000
+
+# Prices listed per missing-range analysis by default, the most one request may ask for, and ranges per request
+RANGE_SAMPLE_SIZE = 20
+MAX_RANGE_SAMPLE = 1000
+MAX_RANGES = 1000
+
+# Series shorter than this are grouped in-process even with workers set
+SHARD_MIN_PRICES = 200_000
+
+# Relative margin on hard breaks, gaps no grouping method can bridge
+HARD_BREAK_SLACK = 1e-9
+
+# Level type produced by each price column, in type-code order
+LEVEL_TYPES = ['Resistance', 'Support', 'Volume', 'Pivot', 'VWAP', 'Gap']
+LEVEL_COLUMNS = [('High', 'Resistance'), ('Low', 'Support')]
+
+# Tolerance modes with one dollar tolerance per series; atr uses a multiple of the timeframe's ATR
+FIXED_TOLERANCE_MODES = ("current_price", "atr")
+ATR_PERIOD = 14
+
+# Bars on each side of a swing high/low that anchors a VWAP
+VWAP_ANCHOR_BARS = 10
+
+# Significance stage: default time budget (seconds), most bar draws held per replicate batch, most pool processes
+SIGNIFICANCE_TIME_BUDGET = 10.0
+SIGNIFICANCE_BATCH_CELLS = 4_000_000
+SIGNIFICANCE_MAX_WORKERS = 4
+
+# Half-life of a touch's weight when levels are ranked by recency
+RECENCY_HALF_LIFE_DAYS = 90
+
+# Columns of the per-bar level feature export, and its default level-count band (% of close)
+LEVEL_FEATURE_COLUMNS = ['support_distance', 'support_strength', 'resistance_distance', 'resistance_strength', 'levels_within']
+LEVEL_FEATURE_WITHIN_PERCENTAGE = 1.0
+
+# Upper bound on candidate evaluations for one component of optimal grouping
+OPTIMAL_MAX_WORK = 20_000_000
+
+def _rounding_slack(n):
+    """Relative slack covering rounding in a running mean of up to n prices
+
+    A vectorized bound only decides a split when it clears the exact test by
+    more than this; anything closer is settled by the sequential walk instead.
+    """
+    return 4 * np.finfo(float).eps * max(n, 1)
+
+# Grouping engine - works on sorted contiguous float arrays and returns group
+# boundaries as start indices into that array. Every entry point also accepts
+# per-price counts so tick-compressed (price, count) pairs group like the
+# expanded series.
+def finite_price_array(prices):
+    """Return finite prices as a contiguous float64 array in input order"""
+    if isinstance(prices, pd.Series):
+        values = prices.to_numpy(dtype=float, na_value=np.nan)
+    else:
+        values = np.asarray(prices, dtype=float)
+    return np.ascontiguousarray(values[~np.isnan(values)])
+
+def sorted_price_array(prices):
+    """Return finite prices as a sorted contiguous float64 array"""
+    values = finite_price_array(prices)
+    values.sort()
+    return values
+
+def tick_price_counts(prices, tick_size):
+    """Snap prices to an int64 tick grid and collapse them to unique (price, count) pairs"""
+    ticks = np.rint(finite_price_array(prices) / tick_size).astype(np.int64)
+    unique_ticks, counts = np.unique(ticks, return_counts=True)
+    return unique_ticks * tick_size, counts.astype(np.int64)
+
+def _walk_conservative_level_price(values, counts, tolerance_percentage):
+    """Exact conservative walk where the tolerance follows the running group mean"""
+    starts = [0]
+    group_sum = values[0] * counts[0]
+    group_count = counts[0]
+    previous = values[0]
+    for i in range(1, len(values)):
+        price = values[i]
+        if price - previous <= (group_sum / group_count) * tolerance_percentage:
+            group_sum += price * counts[i]
+            group_count += counts[i]
+        else:
+            starts.append(i)
+            group_sum = price * counts[i]
+            group_count = counts[i]
+        previous = price
+    return starts
+
+def _conservative_segment_walk(values, counts, segment_starts, segment_ends, tolerance_percentage):
+    """_walk_conservative_level_price over many segments of typed arrays, returning the new splits"""
+    splits = np.empty(len(values), dtype=np.int64)
+    split_count = 0
+    for segment in range(len(segment_starts)):
+        start = segment_starts[segment]
+        group_sum = values[start] * counts[start]
+        group_count = counts[start]
+        previous = values[start]
+        for i in range(start + 1, segment_ends[segment]):
+            price = values[i]
+            if price - previous <= (group_sum / group_count) * tolerance_percentage:
+                group_sum += price * counts[i]
+                group_count += counts[i]
+            else:
+                splits[split_count] = i
+                split_count += 1
+                group_sum = price * counts[i]
+                group_count = counts[i]
+            previous = price
+    return splits[:split_count]
+
+def _aggressive_segment_walk(values, counts, segment_starts, segment_ends, base_tolerance, tolerance_percentage, relative):
+    """_walk_aggressive over many segments of typed arrays, returning the new splits"""
+    splits = np.empty(len(values), dtype=np.int64)
+    split_count = 0
+    for segment in range(len(segment_starts)):
+        start = segment_starts[segment]
+        group_sum = values[start] * counts[start]
+        group_count = counts[start]
+        for i in range(start + 1, segment_ends[segment]):
+            price = values[i]
+            group_center = group_sum / group_count
+            tolerance = group_center * tolerance_percentage if relative else base_tolerance
+            if abs(price - group_center) <= tolerance:
+                group_sum += price * counts[i]
+                group_count += counts[i]
+            else:
+                splits[split_count] = i
+                split_count += 1
+                group_sum = price * counts[i]
+                group_count = counts[i]
+    return splits[:split_count]
+
+def _compile_segment_walks(cache=True):
+    """Numba-compiled segment walks keyed by the Python walk they replace; empty without Numba
+
+    Set SR_DISABLE_JIT=1 to keep the Python walks even when Numba is installed.
+    """
+    if njit is None or os.environ.get('SR_DISABLE_JIT'):
+        return {}
+    conservative = njit(cache=cache, nogil=True)(_conservative_segment_walk)
+    aggressive = njit(cache=cache, nogil=True)(_aggressive_segment_walk)
+    
+    def aggressive_walk(values, counts, segment_starts, segment_ends, base_tolerance, tolerance_percentage):
+        relative = tolerance_percentage is not None
+        return aggressive(values, counts, segment_starts, segment_ends, float(base_tolerance),
+                          float(tolerance_percentage) if relative else 0.0, relative)
+    
+    def conservative_walk(values, counts, segment_starts, segment_ends, tolerance_percentage):
+        return conservative(values, counts, segment_starts, segment_ends, float(tolerance_percentage))
+    
+    walks = {_walk_conservative_level_price: conservative_walk, _walk_aggressive: aggressive_walk}
+    try:
+        _warm_up(walks)
+    except Exception as e:
+        # A stale on-disk cache can fail to load; compile afresh before giving up
+        if cache:
+            return _compile_segment_walks(cache=False)
+        print(f"JIT walks unavailable, using Python walks: {e}")
+        return {}
+    return walks
+
+def _warm_up(walks):
+    values = np.array([1.0, 1.001, 2.0])
+    counts = np.ones(3, dtype=np.int64)
+    bounds = (np.array([0], dtype=np.int64), np.array([3], dtype=np.int64))
+    for walk, args in [(_walk_conservative_level_price, (0.01,)), (_walk_aggressive, (0.01, None)),
+                       (_walk_aggressive, (0.01, 0.01))]:
+        if walk in walks:
+            walks[walk](values, counts, *bounds, *args)
+
+def warm_up_walks():
+    """Compile the JIT walks now rather than on the first request (no-op without Numba)"""
+    _warm_up(SEGMENT_WALKS)
+
+def _refine_segments(sorted_prices, counts, segment_starts, unsettled, walk, *walk_args):
+    """Run the exact walk over unsettled segments and merge its splits with the vectorized ones"""
+    if not unsettled.any():
+        return segment_starts
+    segment_ends = np.append(segment_starts[1:], len(sorted_prices))
+    if walk in SEGMENT_WALKS:
+        typed_counts = np.ones(len(sorted_prices), dtype=np.int64) if counts is None else counts.astype(np.int64, copy=False)
+        extra_starts = SEGMENT_WALKS[walk](np.ascontiguousarray(sorted_prices, dtype=float), typed_counts,
+                                           segment_starts[unsettled].astype(np.int64), segment_ends[unsettled].astype(np.int64),
+                                           *walk_args)
+        return np.union1d(segment_starts, extra_starts) if len(extra_starts) else segment_starts
+    extra_starts = []
+    for start, end in zip(segment_starts[unsettled].tolist(), segment_ends[unsettled].tolist()):
+        segment_counts = [1] * (end - start) if counts is None else counts[start:end].tolist()
+        local_starts = walk(sorted_prices[start:end].tolist(), segment_counts, *walk_args)
+        extra_starts.extend(start + s for s in local_starts[1:])
+    if not extra_starts:
+        return segment_starts
+    return np.union1d(segment_starts, np.asarray(extra_starts, dtype=np.int64))
+
+def _total_count(sorted_prices, counts):
+    return len(sorted_prices) if counts is None else int(counts.sum())
+
+def conservative_group_starts(sorted_prices, base_tolerance, tolerance_percentage=None, counts=None):
+    """Group starts for conservative grouping (gap to the nearest group member)
+
+    With tolerance_percentage=None the tolerance is the fixed base_tolerance and
+    every split is a plain gap test. Otherwise the tolerance is a percentage of
+    the running group mean, which always lies between the segment's first price
+    and the previous price, so only gaps between those two bounds need the walk.
+    """
+    n = len(sorted_prices)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    gaps = np.diff(sorted_prices)
+    if tolerance_percentage is None:
+        return np.concatenate(([0], np.flatnonzero(gaps > base_tolerance) + 1)).astype(np.int64)
+
+    slack = _rounding_slack(_total_count(sorted_prices, counts))
+    upper = sorted_prices[:-1] * tolerance_percentage
+    upper += np.abs(upper) * slack
+    split = gaps > upper
+    segment_starts = np.concatenate(([0], np.flatnonzero(split) + 1)).astype(np.int64)
+
+    segment_of_gap = np.cumsum(split)
+    lower = sorted_prices[segment_starts[segment_of_gap]] * tolerance_percentage
+    lower -= np.abs(lower) * slack
+    ambiguous = ~split & (gaps > lower)
+    unsettled = np.zeros(len(segment_starts), dtype=bool)
+    unsettled[segment_of_gap[ambiguous]] = True
+    return _refine_segments(sorted_prices, counts, segment_starts, unsettled,
+                            _walk_conservative_level_price, tolerance_percentage)
+
+def _walk_aggressive(values, counts, base_tolerance, tolerance_percentage):
+    """Exact aggressive walk comparing each price with the running group centroid"""
+    starts = [0]
+    group_sum = values[0] * counts[0]
+    group_count = counts[0]
+    for i in range(1, len(values)):
+        price = values[i]
+        group_center = group_sum / group_count
+        if tolerance_percentage is None:
+            tolerance = base_tolerance
+        else:
+            tolerance = group_center * tolerance_percentage
+        if abs(price - group_center) <= tolerance:
+            group_sum += price * counts[i]
+            group_count += counts[i]
+        else:
+            starts.append(i)
+            group_sum = price * counts[i]
+            group_count = counts[i]
+    return starts
+
+def aggressive_group_starts(sorted_prices, base_tolerance, tolerance_percentage=None, counts=None):
+    """Group starts for aggressive grouping (distance to the running group centroid)
+
+    The centroid lies between the group's first price and the previous price, so
+    a gap wider than the tolerance always splits and a segment whose whole spread
+    fits inside the tolerance is always one group. Only the remaining segments
+    are walked with a running sum and count.
+    """
+    n = len(sorted_prices)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    slack = _rounding_slack(_total_count(sorted_prices, counts))
+    gaps = np.diff(sorted_prices)
+    previous = sorted_prices[:-1]
+    if tolerance_percentage is None:
+        split_bound = base_tolerance
+    else:
+        split_bound = previous * tolerance_percentage
+        split_bound = split_bound + np.abs(split_bound) * slack
+    split = gaps - np.abs(previous) * slack > split_bound
+    segment_starts = np.concatenate(([0], np.flatnonzero(split) + 1)).astype(np.int64)
+
+    segment_ends = np.append(segment_starts[1:], n)
+    lows = sorted_prices[segment_starts]
+    highs = sorted_prices[segment_ends - 1]
+    spreads = highs - lows + np.maximum(np.abs(highs), np.abs(lows)) * slack
+    if tolerance_percentage is None:
+        settled = spreads <= base_tolerance
+    else:
+        settled_bound = lows * tolerance_percentage
+        settled = spreads <= settled_bound - np.abs(settled_bound) * slack
+    return _refine_segments(sorted_prices, counts, segment_starts, ~settled,
+                            _walk_aggressive, base_tolerance, tolerance_percentage)
+
+# Compiled segment walks, picked and warmed up once at import
+SEGMENT_WALKS = _compile_segment_walks()
+
+def _optimal_partition(values, weights, max_spread):
+    """Fewest groups of spread <= max_spread, then least weighted within-group SSE
+
+    Dynamic program over prefixes of one chained component. The fewest groups
+    for a prefix never decreases with its length, so for each prefix end only
+    the starts that keep that minimum are scanned for the lowest SSE.
+    """
+    m = len(values)
+    centered = values - values.mean()
+    cumulative_weight = np.concatenate(([0.0], np.cumsum(weights, dtype=float)))
+    cumulative_sum = np.concatenate(([0.0], np.cumsum(weights * centered)))
+    cumulative_square = np.concatenate(([0.0], np.cumsum(weights * centered * centered)))
+    earliest_start = np.searchsorted(values, values - max_spread, side='left')
+    
+    group_counts = np.zeros(m + 1, dtype=np.int64)
+    costs = np.zeros(m + 1)
+    best_start = np.zeros(m + 1, dtype=np.int64)
+    for end in range(1, m + 1):
+        low = earliest_start[end - 1]
+        high = low + np.searchsorted(group_counts[low:end], group_counts[low], side='right')
+        starts = np.arange(low, high)
+        group_weight = cumulative_weight[end] - cumulative_weight[starts]
+        group_sum = cumulative_sum[end] - cumulative_sum[starts]
+        candidate_costs = costs[starts] + (cumulative_square[end] - cumulative_square[starts]) - group_sum * group_sum / group_weight
+        best = int(candidate_costs.argmin())
+        best_start[end] = low + best
+        group_counts[end] = group_counts[low] + 1
+        costs[end] = candidate_costs[best]
+    
+    starts = []
+    end = m
+    while end > 0:
+        end = int(best_start[end])
+        starts.append(end)
+    return starts[::-1]
+
+def _greedy_spread_starts(values, max_spread):
+    """Starts of the left-to-right split into groups spanning at most max_spread (fewest groups, not least SSE)"""
+    starts = [0]
+    while True:
+        next_start = int(np.searchsorted(values, values[starts[-1]] + max_spread, side='right'))
+        if next_start >= len(values):
+            return starts
+        starts.append(next_start)
+
+def optimal_group_starts(sorted_prices, max_spread, counts=None, max_work=OPTIMAL_MAX_WORK):
+    """Group starts of a globally optimal 1D partition with bounded group spread
+
+    Among all partitions whose groups span at most max_spread, picks the one
+    with the fewest groups and, among those, the least within-group variance.
+    Duplicate prices are collapsed to (price, count) pairs first, and gaps wider
+    than max_spread split the series into independent components. A component
+    whose dynamic program would exceed max_work candidate evaluations falls
+    back to a greedy split with the same spread bound.
+    """
+    n = len(sorted_prices)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    if counts is None:
+        unique_index = np.flatnonzero(np.concatenate(([True], np.diff(sorted_prices) != 0)))
+        values = sorted_prices[unique_index]
+        weights = np.diff(np.append(unique_index, n))
+    else:
+        unique_index = np.arange(n)
+        values = sorted_prices
+        weights = counts
+    
+    component_starts = np.concatenate(([0], np.flatnonzero(np.diff(values) > max_spread) + 1))
+    component_ends = np.append(component_starts[1:], len(values))
+    wide = np.flatnonzero(values[component_ends - 1] - values[component_starts] > max_spread)
+    if len(wide) == 0:
+        return unique_index[component_starts].astype(np.int64)
+    
+    starts = component_starts.tolist()
+    for component in wide.tolist():
+        start, end = int(component_starts[component]), int(component_ends[component])
+        segment = values[start:end]
+        work = int((np.arange(end - start) - np.searchsorted(segment, segment - max_spread, side='left')).sum())
+        if work > max_work:
+            print(f"Optimal grouping skipped for {end - start} prices ({work} candidates), using greedy split")
+            local_starts = _greedy_spread_starts(segment, max_spread)
+        else:
+            local_starts = _optimal_partition(segment, weights[start:end], max_spread)
+        starts.extend(start + s for s in local_starts[1:])
+    return unique_index[np.unique(starts)].astype(np.int64)
+
+def segment_levels(sorted_prices, starts, counts=None):
+    """Level price (group median), touches, low and high of each group of a sorted series"""
+    if len(starts) == 0:
+        empty = np.empty(0)
+        return empty, np.empty(0, dtype=np.int64), empty, empty
+    ends = np.append(starts[1:], len(sorted_prices))
+    if counts is None:
+        sizes = ends - starts
+        lower_middle = starts + (sizes - 1) // 2
+        upper_middle = starts + sizes // 2
+    else:
+        # Locate the middle touches of each group through the running count
+        sizes = np.add.reduceat(counts, starts)
+        cumulative_counts = np.cumsum(counts)
+        touches_before = cumulative_counts[starts] - counts[starts]
+        lower_middle = np.searchsorted(cumulative_counts, touches_before + (sizes - 1) // 2, side='right')
+        upper_middle = np.searchsorted(cumulative_counts, touches_before + sizes // 2, side='right')
+    # Median of a sorted run; for one or two prices this is also the mean
+    level_prices = (sorted_prices[lower_middle] + sorted_prices[upper_middle]) / 2
+    return level_prices, sizes, sorted_prices[starts], sorted_prices[ends - 1]
+
+def touch_segments(values, times, boundaries):
+    """Touch timestamps in price order and where each price range split at boundaries starts
+
+    Timestamps ride along the price argsort, so each range is one segment of
+    the sorted touches.
+    """
+    order = np.argsort(values, kind='stable')
+    starts = np.concatenate(([0], np.searchsorted(values[order], boundaries, side='right')))
+    return times[order], starts
+
+def touch_time_reductions(sorted_times, starts, reference_time=None, half_life=None):
+    """First touch, last touch and, with a half_life, decayed touch count of each segment
+
+    A touch at the reference time counts 1, one half_life earlier 0.5.
+    """
+    decayed = None
+    if half_life:
+        decayed = np.add.reduceat(np.exp2((sorted_times - reference_time) / half_life), starts)
+    return np.minimum.reduceat(sorted_times, starts), np.maximum.reduceat(sorted_times, starts), decayed
+
+def role_reversals(labels, times, roles, group_count):
+    """Role flips per group: touches in time order whose role differs from the previous touch
+
+    labels, times and roles (+1 resistance, -1 support) describe one touch
+    each. Sorting by label then time lines every group's touches up, so flips
+    are the sign changes of a label-wise diff. Touches of one group at one time
+    with both roles (a bar whose High and Low both fall in the group) show no
+    side and are dropped. Returns flip counts and the first and last flip time
+    of each group.
+    """
+    order = np.lexsort((roles, times, labels))
+    labels, times, roles = labels[order], times[order], roles[order]
+    # Roles are sorted within each (label, time) run, so a run has both when its ends differ
+    run_starts = np.flatnonzero(np.concatenate(([True], (np.diff(labels) != 0) | (np.diff(times) != 0))))[:len(labels)]
+    run_ends = np.append(run_starts, len(labels))[1:]
+    one_sided = np.repeat(roles[run_starts] == roles[run_ends - 1], run_ends - run_starts)
+    labels, times, roles = labels[one_sided], times[one_sided], roles[one_sided]
+    flipped = (np.diff(roles) != 0) & (np.diff(labels) == 0)
+    flip_labels, flip_times = labels[1:][flipped], times[1:][flipped]
+    counts = np.bincount(flip_labels, minlength=group_count)
+    first_flips = np.full(group_count, np.iinfo(np.int64).max)
+    last_flips = np.full(group_count, np.iinfo(np.int64).min)
+    # Flips of one label are in time order: its first and last entries are the extremes
+    flip_groups, first_index = np.unique(flip_labels, return_index=True)
+    first_flips[flip_groups] = flip_times[first_index]
+    last_index = len(flip_labels) - 1 - np.unique(flip_labels[::-1], return_index=True)[1]
+    last_flips[flip_groups] = flip_times[last_index]
+    return counts, first_flips, last_flips
+
+def undated_touch_times(touches):
+    """Touch-time arrays for levels without timestamps: no first/last touch, no decay"""
+    n = len(touches)
+    return (np.full(n, np.iinfo(np.int64).max), np.full(n, np.iinfo(np.int64).min), touches.astype(float))
+
+def format_touch_time(nanoseconds):
+    if nanoseconds in (np.iinfo(np.int64).max, np.iinfo(np.int64).min):
+        return None
+    return pd.Timestamp(nanoseconds).isoformat()
+
+def pivot_mask(prices, column, pivot_window):
+    """Swing pivots: a high that is the max of its +/-N bar window (a low that is the min)
+
+    prices is a Series, or a DataFrame with one series per column; centered
+    rolling windows run down the rows.
+    """
+    window = prices.rolling(2 * pivot_window + 1, center=True, min_periods=1)
+    extreme = window.max() if column == 'High' else window.min()
+    return prices == extreme
+
+def time_ordered(df):
+    return df if df.index.is_monotonic_increasing else df.sort_index()
+
+def floor_pivot_prices(df):
+    """Classic floor pivots P, R1, S1, R2, S2 of every bar"""
+    high, low, close = (df[column].to_numpy(dtype=float) for column in ('High', 'Low', 'Close'))
+    pivot = (high + low + close) / 3
+    return np.concatenate((pivot, 2 * pivot - low, 2 * pivot - high, pivot + (high - low), pivot - (high - low)))
+
+def anchored_vwap_prices(df):
+    """VWAP at the last bar anchored at every swing high and low
+
+    With cumulative sums of typical price * volume and of volume, the VWAP
+    from anchor a is (pv[-1] - pv[a - 1]) / (v[-1] - v[a - 1]) for all anchors at once.
+    """
+    if 'Volume' not in df.columns:
+        return np.empty(0)
+    df = time_ordered(df)
+    high, low = df['High'], df['Low']
+    window = 2 * VWAP_ANCHOR_BARS + 1
+    anchors = np.flatnonzero(((high == high.rolling(window, center=True, min_periods=1).max())
+                              | (low == low.rolling(window, center=True, min_periods=1).min())).to_numpy())
+    typical = ((high + low + df['Close']) / 3).to_numpy(dtype=float)
+    volume = np.nan_to_num(df['Volume'].to_numpy(dtype=float))
+    price_volume = np.concatenate(([0.0], np.cumsum(np.nan_to_num(typical * volume))))
+    cumulative_volume = np.concatenate(([0.0], np.cumsum(volume)))
+    traded = cumulative_volume[-1] - cumulative_volume[anchors]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(traded > 0, (price_volume[-1] - price_volume[anchors]) / traded, np.nan)
+
+def unfilled_gap_prices(df):
+    """Edges of the part of every price gap between bars that later bars have not filled
+
+    A gap up stays open above the lowest low after it, a gap down below the
+    highest high after it; both come from reversed running min/max.
+    """
+    df = time_ordered(df)
+    high, low = df['High'].to_numpy(dtype=float), df['Low'].to_numpy(dtype=float)
+    if len(high) < 2:
+        return np.empty(0)
+    later_low = np.append(np.minimum.accumulate(low[::-1])[::-1][1:], np.inf)
+    later_high = np.append(np.maximum.accumulate(high[::-1])[::-1][1:], -np.inf)
+    previous_high, previous_low, high, low, later_low, later_high = high[:-1], low[:-1], high[1:], low[1:], later_low[1:], later_high[1:]
+    gap_up = (low > previous_high) & (later_low > previous_high)
+    gap_down = (high < previous_low) & (later_high < previous_low)
+    return np.concatenate((previous_high[gap_up], np.minimum(low, later_low)[gap_up],
+                           previous_low[gap_down], np.maximum(high, later_high)[gap_down]))
+
+# Extra level sources: name -> (level type, candidate prices of a bar frame, default weight)
+LEVEL_SOURCES = {
+    'pivots': ('Pivot', floor_pivot_prices, 1),
+    'vwap': ('VWAP', anchored_vwap_prices, 2),
+    'gaps': ('Gap', unfilled_gap_prices, 1)
+}
+
+def strength_order(timeframe_counts, weighted_touches, top=None):
+    """Indices strongest first: more timeframes, then more weighted touches, ties in index order
+
+    With top, only the first top indices are picked (np.argpartition) and sorted.
+    Integer strengths are packed into one int64 key together with the index;
+    other dtypes fall back to a full lexsort.
+    """
+    n = len(weighted_touches)
+    if top is not None and top >= n:
+        top = None
+    if n and np.issubdtype(weighted_touches.dtype, np.integer):
+        most_timeframes = int(timeframe_counts.max())
+        most_weighted = int(weighted_touches.max())
+        weighted_span = most_weighted - int(weighted_touches.min()) + 1
+        if (most_timeframes + 1) * weighted_span * n < 2 ** 62:
+            key = (((most_timeframes - timeframe_counts).astype(np.int64) * weighted_span
+                    + (most_weighted - weighted_touches)) * n + np.arange(n))
+            if top is None:
+                return np.argsort(key)
+            selected = np.argpartition(key, top - 1)[:top] if top else np.empty(0, dtype=np.int64)
+            return selected[np.argsort(key[selected])]
+    order = np.lexsort((-weighted_touches, -timeframe_counts))
+    return order if top is None else order[:top]
+
+class PriceHierarchy:
+    """Sorted prices of one series plus their single-linkage merge hierarchy
+
+    Gap-based grouping over sorted prices merges neighbours whose gap is within
+    the tolerance, so the merge distance of every adjacent pair is just its gap.
+    Sorting those gaps once lets any tolerance be answered by a threshold cut.
+    
+    With a tick_size the prices are kept as unique tick prices and counts holds
+    how many raw prices fell on each; counts is None for uncompressed series.
+    """
+    def __init__(self, prices, presorted=False, tick_size=None, counts=None):
+        if presorted:
+            self.sorted_prices = prices
+            self.counts = counts
+        elif tick_size:
+            self.sorted_prices, self.counts = tick_price_counts(prices, tick_size)
+        else:
+            self.sorted_prices = sorted_price_array(prices)
+            self.counts = None
+        self.gaps = np.diff(self.sorted_prices)
+        self.merge_order = None
+        self.merge_distances = None
+        self.log_space = None
+    
+    def __len__(self):
+        return len(self.sorted_prices)
+    
+    def build_merge_order(self):
+        if self.merge_order is None:
+            self.merge_order = np.argsort(self.gaps, kind='stable')
+            self.merge_distances = self.gaps[self.merge_order]
+        return self
+    
+    def log_hierarchy(self):
+        """Same prices in log space, where a relative tolerance is a fixed gap"""
+        if self.log_space is None:
+            if len(self.sorted_prices) and self.sorted_prices[0] <= 0:
+                raise ValueError("log_price tolerance mode requires positive prices")
+            self.log_space = PriceHierarchy(np.log(self.sorted_prices), presorted=True, counts=self.counts)
+        return self.log_space
+    
+    def cut(self, threshold):
+        """Group starts when neighbours more than threshold apart are kept apart"""
+        if len(self.sorted_prices) == 0:
+            return np.empty(0, dtype=np.int64)
+        if self.merge_order is None:
+            breaks = np.flatnonzero(self.gaps > threshold)
+        else:
+            # Only the gaps above the threshold are touched: O(k log k) for k groups
+            first_kept = np.searchsorted(self.merge_distances, threshold, side='right')
+            breaks = np.sort(self.merge_order[first_kept:])
+        return np.concatenate(([0], breaks + 1)).astype(np.int64)
+
+class IncrementalSeries:
+    """Sorted prices of one series with their groups kept current under inserts
+
+    No grouping method joins two neighbouring prices across a hard break (a gap
+    wider than any tolerance it can apply), so the prices between two hard
+    breaks group independently of everything else. Inserting prices regroups
+    only the run between the hard breaks around the insert positions.
+    """
+    def __init__(self, hierarchy, group_starts, hard_breaks, tick_size=None):
+        self.sorted_prices = hierarchy.sorted_prices
+        self.counts = hierarchy.counts
+        self.group_starts = group_starts
+        self.hard_breaks = hard_breaks
+        self.tick_size = tick_size
+        self.starts = self._regroup(0, len(self.sorted_prices))
+        self.levels, self.touches, self.lows, self.highs = segment_levels(self.sorted_prices, self.starts, self.counts)
+    
+    def _regroup(self, start, end):
+        if end <= start:
+            return np.empty(0, dtype=np.int64)
+        counts = None if self.counts is None else self.counts[start:end]
+        return self.group_starts(PriceHierarchy(self.sorted_prices[start:end], presorted=True, counts=counts))
+    
+    def _merge_prices(self, prices):
+        """Merge new prices into the sorted arrays; returns touched positions in the new arrays"""
+        if self.tick_size:
+            values, counts = tick_price_counts(prices, self.tick_size)
+            positions = np.searchsorted(self.sorted_prices, values)
+            existing = positions < len(self.sorted_prices)
+            existing[existing] = self.sorted_prices[positions[existing]] == values[existing]
+            self.counts = self.counts.copy()
+            self.counts[positions[existing]] += counts[existing]
+            fresh = ~existing
+            self.sorted_prices = np.insert(self.sorted_prices, positions[fresh], values[fresh])
+            self.counts = np.insert(self.counts, positions[fresh], counts[fresh])
+            shifted = positions + np.cumsum(fresh) - fresh
+            return shifted, int(fresh.sum())
+        values = sorted_price_array(prices)
+        positions = np.searchsorted(self.sorted_prices, values, side='right')
+        self.sorted_prices = np.insert(self.sorted_prices, positions, values)
+        return positions + np.arange(len(values)), len(values)
+    
+    def insert(self, prices):
+        """Insert prices and regroup around them
+
+        Returns (first_group, old_end, new_end): groups [first_group, old_end) of
+        the previous grouping were replaced by groups [first_group, new_end).
+        """
+        touched, inserted = self._merge_prices(prices)
+        if len(touched) == 0:
+            return None
+        
+        breaks = np.flatnonzero(self.hard_breaks(self.sorted_prices)) + 1
+        first, last = int(touched.min()), int(touched.max())
+        window_start = int(breaks[np.searchsorted(breaks, first, side='right') - 1]) if len(breaks) and breaks[0] <= first else 0
+        following = np.searchsorted(breaks, last, side='right')
+        window_end = int(breaks[following]) if following < len(breaks) else len(self.sorted_prices)
+        
+        # Both window edges sit on hard breaks that existed before the insert too
+        return self._splice(window_start, window_end - inserted, window_end)
+    
+    def _drop_prices(self, prices):
+        """Remove prices from the sorted arrays; returns their positions in the old arrays"""
+        if self.tick_size:
+            values, counts = tick_price_counts(prices, self.tick_size)
+            positions = np.searchsorted(self.sorted_prices, values)
+            self.counts = self.counts.copy()
+            self.counts[positions] -= counts
+            emptied = positions[self.counts[positions] == 0]
+            self.sorted_prices = np.delete(self.sorted_prices, emptied)
+            self.counts = np.delete(self.counts, emptied)
+            return positions, len(emptied)
+        values = sorted_price_array(prices)
+        # Equal prices are interchangeable, so repeats take consecutive slots
+        repeat = np.arange(len(values)) - np.searchsorted(values, values, side='left')
+        positions = np.searchsorted(self.sorted_prices, values, side='left') + repeat
+        self.sorted_prices = np.delete(self.sorted_prices, positions)
+        return positions, len(values)
+    
+    def remove(self, prices):
+        """Remove previously inserted prices and regroup around them
+        
+        Returns (first_group, old_end, new_end) like insert.
+        """
+        if len(self.sorted_prices) == 0:
+            return None
+        # Removing prices only widens gaps, so hard breaks found beforehand stay hard
+        breaks = np.flatnonzero(self.hard_breaks(self.sorted_prices)) + 1
+        old_length = len(self.sorted_prices)
+        touched, removed = self._drop_prices(prices)
+        if len(touched) == 0:
+            return None
+        
+        first, last = int(touched.min()), int(touched.max())
+        window_start = int(breaks[np.searchsorted(breaks, first, side='right') - 1]) if len(breaks) and breaks[0] <= first else 0
+        following = np.searchsorted(breaks, last, side='right')
+        window_end = int(breaks[following]) if following < len(breaks) else old_length
+        return self._splice(window_start, window_end, window_end - removed)
+    
+    def _splice(self, window_start, old_window_end, window_end):
+        """Regroup [window_start, window_end) of the current arrays in place of the groups of [window_start, old_window_end)"""
+        first_group = int(np.searchsorted(self.starts, window_start, side='left'))
+        old_end = int(np.searchsorted(self.starts, old_window_end, side='left'))
+        local_starts = self._regroup(window_start, window_end) + window_start
+        new_end = first_group + len(local_starts)
+        
+        self.starts = np.concatenate((self.starts[:first_group], local_starts, self.starts[old_end:] + (window_end - old_window_end)))
+        levels, touches, lows, highs = segment_levels(self.sorted_prices[window_start:window_end], local_starts - window_start,
+                                                      None if self.counts is None else self.counts[window_start:window_end])
+        self.levels = np.concatenate((self.levels[:first_group], levels, self.levels[old_end:]))
+        self.touches = np.concatenate((self.touches[:first_group], touches, self.touches[old_end:]))
+        self.lows = np.concatenate((self.lows[:first_group], lows, self.lows[old_end:]))
+        self.highs = np.concatenate((self.highs[:first_group], highs, self.highs[old_end:]))
+        return first_group, old_end, new_end
+
+class ConfluenceState:
+    """Price-ordered levels of every series with their confluence groups
+
+    Confluence grouping only compares neighbouring levels, so replacing the
+    levels of one series in a price range regroups only the confluence groups
+    overlapping that range, widened until its edges stay split.
+    """
+    def __init__(self, finder, type_names, timeframe_names):
+        self.finder = finder
+        self.type_names = type_names
+        self.timeframe_names = timeframe_names
+        self.prices = np.empty(0)
+        self.touches = np.empty(0, dtype=np.int64)
+        self.weighted_touches = np.empty(0, dtype=np.int64)
+        self.type_codes = np.empty(0, dtype=np.int64)
+        self.timeframe_codes = np.empty(0, dtype=np.int64)
+        self.series_codes = np.empty(0, dtype=np.int64)
+        self.groups = self._reduce(0, 0, np.empty(0, dtype=np.int64))
+    
+    def _reduce(self, start, end, local_starts):
+        return self.finder.reduce_confluence_groups(
+            self.prices[start:end], self.touches[start:end], self.weighted_touches[start:end],
+            self.type_codes[start:end], len(self.type_names),
+            self.timeframe_codes[start:end], len(self.timeframe_names), local_starts)
+    
+    def _joined(self, lower, upper):
+        return len(self.finder.similar_level_starts(np.array([lower, upper]))) == 1
+    
+    def replace_series_levels(self, series_code, removed_prices, prices, touches, weight, type_code, timeframe_code):
+        changed = np.concatenate((removed_prices, prices))
+        if len(changed) == 0:
+            return
+        
+        if len(removed_prices):
+            first = np.searchsorted(self.prices, removed_prices.min(), side='left')
+            last = np.searchsorted(self.prices, removed_prices.max(), side='right')
+            drop = first + np.flatnonzero(self.series_codes[first:last] == series_code)
+            for name in ['prices', 'touches', 'weighted_touches', 'type_codes', 'timeframe_codes', 'series_codes']:
+                setattr(self, name, np.delete(getattr(self, name), drop))
+        if len(prices):
+            positions = np.searchsorted(self.prices, prices, side='right')
+            count = len(prices)
+            self.prices = np.insert(self.prices, positions, prices)
+            self.touches = np.insert(self.touches, positions, touches)
+            self.weighted_touches = np.insert(self.weighted_touches, positions, touches * weight)
+            self.type_codes = np.insert(self.type_codes, positions, np.full(count, type_code))
+            self.timeframe_codes = np.insert(self.timeframe_codes, positions, np.full(count, timeframe_code))
+            self.series_codes = np.insert(self.series_codes, positions, np.full(count, series_code))
+        
+        changed_low, changed_high = changed.min(), changed.max()
+        group_count = len(self.groups['lows'])
+        first_group = max(int(np.searchsorted(self.groups['highs'], changed_low, side='left')) - 1, 0)
+        end_group = min(int(np.searchsorted(self.groups['lows'], changed_high, side='right')) + 1, group_count)
+        while True:
+            low = min(self.groups['lows'][first_group], changed_low) if first_group < group_count else changed_low
+            high = max(self.groups['highs'][end_group - 1], changed_high) if end_group > 0 else changed_high
+            start = int(np.searchsorted(self.prices, low, side='left'))
+            end = int(np.searchsorted(self.prices, high, side='right'))
+            if start > 0 and first_group > 0 and self._joined(self.prices[start - 1], self.prices[start]):
+                first_group -= 1
+                continue
+            if end < len(self.prices) and end_group < group_count and self._joined(self.prices[end - 1], self.prices[end]):
+                end_group += 1
+                continue
+            break
+        
+        local_starts = self.finder.similar_level_starts(self.prices[start:end]) if end > start else np.empty(0, dtype=np.int64)
+        window_groups = self._reduce(start, end, local_starts)
+        for name, values in self.groups.items():
+            self.groups[name] = np.concatenate((values[:first_group], window_groups[name], values[end_group:]))
+
+class PartialLevels:
+    """Groups of one price-ordered shard of a series, mergeable with the next shard
+
+    A shard is grouped as if it stood alone. The conservative and aggressive
+    walks only look back to the current group start and restart their state at
+    every start, so joining the next shard can only change groups from the left
+    shard's last group up to the first start both groupings share. merge
+    re-walks that stretch and keeps everything else. Optimal grouping is not a
+    walk, so its shards must be cut at hard breaks and merge just concatenates.
+    Plain arrays, so partial results pickle for process pools and caches.
+    """
+    def __init__(self, sorted_prices, counts, starts):
+        self.sorted_prices = sorted_prices
+        self.counts = counts
+        self.starts = starts
+    
+    def __len__(self):
+        return len(self.sorted_prices)
+    
+    def merge(self, other, group_starts=None):
+        """This shard followed by other, regrouped at the seam with group_starts"""
+        if len(self) == 0:
+            return other
+        if len(other) == 0:
+            return self
+        counts = None if self.counts is None else np.concatenate((self.counts, other.counts))
+        prices = np.concatenate((self.sorted_prices, other.sorted_prices))
+        if group_starts is None:
+            return PartialLevels(prices, counts, np.concatenate((self.starts, other.starts + len(self))))
+        
+        tail = int(self.starts[-1])
+        tail_length = len(self) - tail
+        # Re-walk from the last left group over a doubling prefix of the right shard
+        # until it starts a group where the right shard's own grouping does
+        length = min(len(other), 64)
+        while True:
+            seam = PriceHierarchy(prices[tail:len(self) + length], presorted=True,
+                                  counts=None if counts is None else counts[tail:len(self) + length])
+            seam_starts = group_starts(seam) - tail_length
+            shared = np.intersect1d(seam_starts[seam_starts >= 0], other.starts)
+            if len(shared) or length == len(other):
+                break
+            length = min(2 * length, len(other))
+        resync = int(shared[0]) if len(shared) else len(other)
+        starts = np.concatenate((self.starts[:-1], tail + tail_length + seam_starts[seam_starts < resync],
+                                 len(self) + other.starts[other.starts >= resync]))
+        return PartialLevels(prices, counts, starts.astype(np.int64))
+
+def _shard_group_starts(task):
+    """Process pool worker: group one shard on its own"""
+    group_starts, sorted_prices, counts = task
+    return group_starts(PriceHierarchy(sorted_prices, presorted=True, counts=counts))
+
+def smoothed_peaks(histogram, smoothing):
+    """Local maxima of the histogram smoothed by a triangular kernel of half-width smoothing bins"""
+    if smoothing > 0:
+        kernel = np.concatenate((np.arange(1, smoothing + 2), np.arange(smoothing, 0, -1))).astype(float)
+        density = np.convolve(histogram, kernel, mode='same')
+    else:
+        density = histogram.astype(float)
+    padded = np.concatenate(([-np.inf], density, [-np.inf]))
+    # Strict on the left so a flat top yields a single peak
+    return np.flatnonzero((density > padded[:-2]) & (density >= padded[2:]) & (density > 0))
+
+class DensityBasins:
+    """Density-peak grouping of one price series without sorting
+
+    Prices are binned on a grid one tolerance wide with np.bincount, the
+    histogram is optionally smoothed with a triangular kernel of half-width
+    smoothing bins, and every local maximum of the smoothed density becomes a
+    level. Each bin belongs to the basin of its nearest peak, so touches are
+    read straight off the bins. Cost is O(n + bins).
+    """
+    MAX_BINS = 10_000_000
+    
+    def __init__(self, values, bin_width, smoothing=1, counts=None):
+        lowest = values.min()
+        bins = ((values - lowest) / bin_width).astype(np.int64)
+        bin_count = int(bins.max()) + 1
+        if bin_count > self.MAX_BINS:
+            raise ValueError(f"Density grid needs {bin_count} bins; use a wider tolerance")
+        if counts is None:
+            histogram = np.bincount(bins, minlength=bin_count)
+            bin_sums = np.bincount(bins, weights=values, minlength=bin_count)
+        else:
+            histogram = np.bincount(bins, weights=counts, minlength=bin_count).astype(np.int64)
+            bin_sums = np.bincount(bins, weights=values * counts, minlength=bin_count)
+        
+        peaks = smoothed_peaks(histogram, smoothing)
+        
+        # Level price: mean of the raw prices under the kernel around each peak
+        cumulative_counts = np.concatenate(([0], np.cumsum(histogram)))
+        cumulative_sums = np.concatenate(([0.0], np.cumsum(bin_sums)))
+        window_start = np.maximum(peaks - smoothing, 0)
+        window_end = np.minimum(peaks + smoothing + 1, bin_count)
+        window_counts = cumulative_counts[window_end] - cumulative_counts[window_start]
+        window_sums = cumulative_sums[window_end] - cumulative_sums[window_start]
+        
+        # Basins split halfway between neighbouring peaks
+        basin_starts = np.concatenate(([0], (peaks[:-1] + peaks[1:] + 1) // 2))
+        touches = np.add.reduceat(histogram, basin_starts)
+        basin_of_value = np.searchsorted(basin_starts, bins, side='right') - 1
+        
+        lows = np.full(len(peaks), np.inf)
+        highs = np.full(len(peaks), -np.inf)
+        np.minimum.at(lows, basin_of_value, values)
+        np.maximum.at(highs, basin_of_value, values)
+        
+        keep = touches > 0
+        if not keep.all():
+            remap = np.cumsum(keep) - 1
+            basin_of_value = remap[basin_of_value]
+        self.peak_bins = peaks[keep]
+        self.peak_means = (window_sums / np.maximum(window_counts, 1))[keep]
+        self.touches = touches[keep]
+        self.lows = lows[keep]
+        self.highs = highs[keep]
+        self.basin_of_value = basin_of_value
+
+class VolumeProfile:
+    """Volume at price of a bar series on a grid of bin_width wide bins
+
+    Each bar's volume is spread evenly over the bins its [low, high] range
+    touches by adding it at the first bin and taking it back after the last
+    one, so one cumulative sum over the difference array gives the profile;
+    the bar coverage of every bin is built the same way. Peaks of the smoothed
+    profile holding at least NODE_RATIO times the mean volume of the traded
+    bins are the high-volume nodes. A node keeps the bins of its peak's basin
+    (split halfway between peaks) that clear the same threshold. Cost is
+    O(bars + bins). With decay, a bar weight per bar, decayed_touches is the
+    decayed bar coverage of each node's peak.
+    """
+    MAX_BINS = 10_000_000
+    NODE_RATIO = 1.0
+    
+    def __init__(self, lows, highs, volumes, bin_width, smoothing=1, decay=None):
+        self.origin = lows.min()
+        self.bin_width = bin_width
+        first_bins = ((lows - self.origin) / bin_width).astype(np.int64)
+        last_bins = np.maximum(((highs - self.origin) / bin_width).astype(np.int64), first_bins)
+        bin_count = int(last_bins.max()) + 1
+        if bin_count > self.MAX_BINS:
+            raise ValueError(f"Volume profile needs {bin_count} bins; use a wider tolerance")
+        
+        volume_per_bin = volumes / (last_bins - first_bins + 1)
+        self.profile = np.maximum(np.cumsum(np.bincount(first_bins, weights=volume_per_bin, minlength=bin_count + 1)
+                                            - np.bincount(last_bins + 1, weights=volume_per_bin, minlength=bin_count + 1))[:-1], 0)
+        self.coverage = np.cumsum(np.bincount(first_bins, minlength=bin_count + 1)
+                                  - np.bincount(last_bins + 1, minlength=bin_count + 1))[:-1]
+        # Same difference array with each bar weighted by its decay, for recency
+        decayed_coverage = None if decay is None else np.cumsum(
+            np.bincount(first_bins, weights=decay, minlength=bin_count + 1)
+            - np.bincount(last_bins + 1, weights=decay, minlength=bin_count + 1))[:-1]
+        
+        traded = self.coverage > 0
+        threshold = self.NODE_RATIO * self.profile[traded].mean() if traded.any() else np.inf
+        peaks = smoothed_peaks(self.profile, smoothing)
+        peaks = peaks[self.profile[peaks] >= threshold]
+        
+        # Node bins: the part of each peak's basin at or above the threshold
+        heavy = np.flatnonzero(self.profile >= threshold) if len(peaks) else np.empty(0, dtype=np.int64)
+        basin_starts = np.concatenate(([0], (peaks[:-1] + peaks[1:] + 1) // 2))
+        node_of_bin = np.searchsorted(basin_starts, heavy, side='right') - 1
+        node_sizes = np.bincount(node_of_bin, minlength=len(peaks))
+        self.node_bins = heavy
+        self.node_starts = np.concatenate(([0], np.cumsum(node_sizes)[:-1])).astype(np.int64)
+        self.volumes = np.add.reduceat(self.profile[heavy], self.node_starts) if len(peaks) else np.empty(0)
+        
+        # Level price: volume-weighted bin centre over the node
+        centres = self.bin_prices(heavy)
+        self.levels = np.add.reduceat(centres * self.profile[heavy], self.node_starts) / self.volumes if len(peaks) else np.empty(0)
+        self.touches = self.coverage[peaks].astype(np.int64)
+        self.decayed_touches = None if decay is None else np.maximum(decayed_coverage[peaks], 0)
+        self.lows = self.origin + heavy[self.node_starts] * bin_width
+        self.highs = self.origin + (heavy[np.append(self.node_starts[1:], len(heavy)) - 1] + 1) * bin_width
+    
+    def __len__(self):
+        return len(self.touches)
+    
+    def bin_prices(self, bins):
+        return self.origin + (bins + 0.5) * self.bin_width
+
+class PriceSummary:
+    """High/Low price counts of one bar history, folded in chunk by chunk
+
+    Prices are kept as sorted unique values (int64 ticks when tick_size is set)
+    with a count per value, so memory grows with the number of distinct prices
+    rather than the number of bars. Only the last RECENT_ROWS bars are kept
+    whole, for the current price and the ATR.
+    """
+    COLUMNS = ['High', 'Low']
+    RECENT_ROWS = 256
+    
+    def __init__(self, tick_size=None):
+        self.tick_size = tick_size
+        key_type = np.int64 if tick_size else float
+        self.keys = {column: np.empty(0, dtype=key_type) for column in self.COLUMNS}
+        self.counts = {column: np.empty(0, dtype=np.int64) for column in self.COLUMNS}
+        self.bar_count = 0
+        self.recent = None
+    
+    def add(self, chunk):
+        for column in self.COLUMNS:
+            values = finite_price_array(chunk[column])
+            if self.tick_size:
+                values = np.rint(values / self.tick_size).astype(np.int64)
+            values, counts = np.unique(values, return_counts=True)
+            keys = np.concatenate((self.keys[column], values))
+            counts = np.concatenate((self.counts[column], counts))
+            order = np.argsort(keys, kind='stable')
+            keys, counts = keys[order], counts[order]
+            starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1]))) if len(keys) else np.empty(0, dtype=np.int64)
+            self.keys[column] = keys[starts]
+            self.counts[column] = np.add.reduceat(counts, starts) if len(starts) else counts
+        if len(chunk):
+            self.bar_count += len(chunk)
+            self.recent = self.recent_rows(self.recent, chunk)
+    
+    def recent_rows(self, earlier, later):
+        if earlier is None or later is None:
+            recent = later if earlier is None else earlier
+        else:
+            recent = pd.concat([earlier, later.tail(self.RECENT_ROWS)])
+        return None if recent is None else recent.tail(self.RECENT_ROWS)
+    
+    def merge(self, other):
+        """Summary of both histories, e.g. of two time partitions cached separately"""
+        if self.tick_size != other.tick_size:
+            raise ValueError("Price summaries with different tick sizes cannot be merged")
+        merged = PriceSummary(self.tick_size)
+        for column in self.COLUMNS:
+            keys = np.concatenate((self.keys[column], other.keys[column]))
+            counts = np.concatenate((self.counts[column], other.counts[column]))
+            merged.keys[column], inverse = np.unique(keys, return_inverse=True)
+            merged.counts[column] = np.zeros(len(merged.keys[column]), dtype=np.int64)
+            np.add.at(merged.counts[column], inverse.reshape(-1), counts)
+        merged.bar_count = self.bar_count + other.bar_count
+        merged.recent = self.recent_rows(self.recent, other.recent)
+        return merged
+    
+    def price_counts(self, column):
+        keys = self.keys[column]
+        return (keys * self.tick_size if self.tick_size else keys), self.counts[column]
+    
+    def to_bytes(self):
+        """The summary as an .npz archive of plain arrays, loadable without pickle"""
+        arrays = {'tick_size': np.array(self.tick_size or 0.0), 'bar_count': np.array(self.bar_count)}
+        for column in self.COLUMNS:
+            arrays[f'keys_{column}'] = self.keys[column]
+            arrays[f'counts_{column}'] = self.counts[column]
+        recent_columns = [] if self.recent is None else list(self.recent.columns)
+        arrays['recent_columns'] = np.array(recent_columns, dtype=str)
+        for i, column in enumerate(recent_columns):
+            arrays[f'recent_{i}'] = self.recent[column].to_numpy(dtype=float)
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+    
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            summary = cls(float(arrays['tick_size']) or None)
+            for column in cls.COLUMNS:
+                summary.keys[column] = arrays[f'keys_{column}']
+                summary.counts[column] = arrays[f'counts_{column}']
+            summary.bar_count = int(arrays['bar_count'])
+            recent_columns = arrays['recent_columns'].tolist()
+            if recent_columns:
+                summary.recent = pd.DataFrame({column: arrays[f'recent_{i}'] for i, column in enumerate(recent_columns)})
+        return summary
+    
+    def recent_bars_frame(self):
+        """The recent bars as an OHLC frame, enough for prepare_data"""
+        recent = self.recent.reset_index(drop=True)
+        return pd.DataFrame({'Open': recent['Open'] if 'Open' in recent else recent['Close'], 'High': recent['High'],
+                             'Low': recent['Low'], 'Close': recent['Close']})
+
+class LevelBatch:
+    """Levels of one price series as parallel arrays over one shared price array
+
+    Group i covers prices[starts[i]:ends[i]]; with counts each price stands for
+    that many touches. Level, touches, low, high and tolerance are arrays, and
+    the per-level details (original prices, range string, spread) are only
+    built when asked for. to_dicts gives the dict form used elsewhere. weight
+    is one number for the series or an array with one weight per level. With
+    touch times tracked, first_touches/last_touches (int64 ns) are set per
+    level, decayed_touches (unweighted) with recency weighting, and
+    touch_times/touch_starts keep every touch's time in level segments.
+    """
+    def __init__(self, prices, counts, starts, levels, touches, lows, highs, tolerances, level_type, timeframe, weight):
+        self.prices = prices
+        self.counts = counts
+        self.starts = starts
+        self.ends = np.append(starts[1:], len(prices))
+        self.levels = levels
+        self.touches = touches
+        self.lows = lows
+        self.highs = highs
+        self.tolerances = tolerances
+        self.level_type = level_type
+        self.timeframe = timeframe
+        self.weight = weight
+        self.first_touches = None
+        self.last_touches = None
+        self.decayed_touches = None
+        self.touch_times = None
+        self.touch_starts = None
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def __getitem__(self, i):
+        return LevelRecord(self, i)
+    
+    def __iter__(self):
+        return (LevelRecord(self, i) for i in range(len(self)))
+    
+    def original_prices(self, i):
+        start, end = self.starts[i], self.ends[i]
+        if self.counts is None:
+            return self.prices[start:end].tolist()
+        return np.repeat(self.prices[start:end], self.counts[start:end]).tolist()
+    
+    def level_weight(self, i):
+        return self.weight if np.isscalar(self.weight) else float(self.weight[i])
+    
+    def price_range(self, i):
+        low, high = float(self.lows[i]), float(self.highs[i])
+        return f"${low:.2f}-${high:.2f}" if self.touches[i] > 1 else f"${low:.2f}"
+    
+    def price_spread(self, i):
+        return float(self.highs[i] - self.lows[i]) if self.touches[i] > 1 else 0
+    
+    def to_dicts(self):
+        levels = []
+        weights = np.broadcast_to(self.weight, len(self)).tolist()
+        for i, (level_price, size, tolerance, weight) in enumerate(zip(self.levels.tolist(), self.touches.tolist(),
+                                                                       self.tolerances.tolist(), weights)):
+            levels.append({
+                'level': level_price,
+                'type': self.level_type,
+                'touches': size,
+                'timeframe': self.timeframe,
+                'weight': weight,
+                'weighted_touches': size * weight,
+                'original_prices': self.original_prices(i),
+                'price_range': self.price_range(i),
+                'tolerance_used': tolerance,
+                'price_spread': self.price_spread(i)
+            })
+            if self.first_touches is not None:
+                levels[-1]['first_touch'] = format_touch_time(int(self.first_touches[i]))
+                levels[-1]['last_touch'] = format_touch_time(int(self.last_touches[i]))
+            if self.decayed_touches is not None:
+                levels[-1]['decayed_strength'] = float(self.decayed_touches[i]) * weight
+        return levels
+
+class LevelRecord:
+    """One level of a LevelBatch; details are read from the batch on access"""
+    __slots__ = ('batch', 'index')
+    
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+    
+    @property
+    def level(self):
+        return float(self.batch.levels[self.index])
+    
+    @property
+    def type(self):
+        return self.batch.level_type
+    
+    @property
+    def touches(self):
+        return int(self.batch.touches[self.index])
+    
+    @property
+    def weighted_touches(self):
+        return self.touches * self.batch.level_weight(self.index)
+    
+    @property
+    def original_prices(self):
+        return self.batch.original_prices(self.index)
+    
+    @property
+    def price_range(self):
+        return self.batch.price_range(self.index)
+    
+    @property
+    def price_spread(self):
+        return self.batch.price_spread(self.index)
+
+class LevelIndex:
+    """Strong levels frozen into price-sorted arrays per level type for nearest-level lookups"""
+    
+    def __init__(self, levels, level_types, strengths):
+        levels = np.asarray(levels, dtype=float)
+        level_types = np.asarray(level_types)
+        strengths = np.asarray(strengths, dtype=float)
+        order = np.argsort(levels, kind='stable')
+        levels, level_types, strengths = levels[order], level_types[order], strengths[order]
+        self.sorted_prices = levels
+        self.prices = {}
+        self.strengths = {}
+        for level_type in np.unique(level_types).tolist():
+            mask = level_types == level_type
+            self.prices[level_type] = levels[mask]
+            self.strengths[level_type] = strengths[mask]
+    
+    def __len__(self):
+        return sum(len(prices) for prices in self.prices.values())
+    
+    def nearest(self, prices, level_type):
+        """(levels, signed distances level - price, strengths) of the closest level_type level to each price, NaN without one"""
+        prices = np.asarray(prices, dtype=float)
+        levels = self.prices.get(level_type, np.empty(0))
+        if len(levels) == 0:
+            empty = np.full(prices.shape, np.nan)
+            return empty, empty.copy(), empty.copy()
+        above = np.minimum(np.searchsorted(levels, prices), len(levels) - 1)
+        below = np.maximum(above - 1, 0)
+        nearest = np.where(np.abs(levels[above] - prices) < np.abs(prices - levels[below]), above, below)
+        distances = levels[nearest] - prices
+        found = ~np.isnan(distances)
+        return np.where(found, levels[nearest], np.nan), distances, np.where(found, self.strengths[level_type][nearest], np.nan)
+    
+    def nearest_levels(self, prices, level_types=('Support', 'Resistance')):
+        """Closest level of each type to every price as flat arrays: '<type>', '<type>_distance', '<type>_strength'"""
+        result = {}
+        for level_type in level_types:
+            key = level_type.lower()
+            result[key], result[f'{key}_distance'], result[f'{key}_strength'] = self.nearest(prices, level_type)
+        return result
+    
+    def count_within(self, prices, percentage):
+        """Levels of any type within +/- percentage % of each price, NaN for NaN prices"""
+        prices = np.asarray(prices, dtype=float)
+        width = np.abs(prices) * percentage / 100.0
+        counts = (np.searchsorted(self.sorted_prices, prices + width, side='right')
+                  - np.searchsorted(self.sorted_prices, prices - width, side='left'))
+        return np.where(np.isnan(prices), np.nan, counts)
+
+class PriceRangeIndex:
+    """Unique High/Low prices with cumulative counts per (timeframe, column), for price range queries"""
+    
+    def __init__(self, series):
+        self.keys = []
+        self.values = []
+        self.cumulative_counts = []
+        for key, (values, counts) in series.items():
+            self.keys.append(key)
+            self.values.append(values)
+            self.cumulative_counts.append(np.concatenate(([0], np.cumsum(counts))))
+    
+    def query(self, starts, ends, sample_size=RANGE_SAMPLE_SIZE):
+        """Counts, spacing stats and a sample of up to sample_size prices for each [start, end] range"""
+        starts = np.asarray(starts, dtype=float)
+        ends = np.asarray(ends, dtype=float)
+        bounds = [(np.searchsorted(values, starts, side='left'), np.searchsorted(values, ends, side='right'))
+                  for values in self.values]
+        results = []
+        for r in range(len(starts)):
+            counts = {}
+            sample = []
+            in_range = []
+            for (timeframe, price_type), values, cumulative, (lower, upper) in zip(
+                    self.keys, self.values, self.cumulative_counts, bounds):
+                lo, hi = lower[r], upper[r]
+                counts.setdefault(timeframe, {})[price_type] = int(cumulative[max(hi, lo)] - cumulative[lo])
+                in_range.append(values[lo:hi])
+                need = sample_size - len(sample)
+                if need > 0 and hi > lo:
+                    taken = values[lo:min(hi, lo + need)]
+                    repeats = np.diff(cumulative[lo:lo + len(taken) + 1])
+                    sample.extend({'timeframe': timeframe, 'type': price_type, 'price': price}
+                                  for price in np.repeat(taken, repeats)[:need].tolist())
+            unique_prices = np.unique(np.concatenate(in_range)) if in_range else np.empty(0)
+            result = {
+                'price_count': sum(count for columns in counts.values() for count in columns.values()),
+                'counts': counts,
+                'prices_in_range': sample
+            }
+            if len(unique_prices) > 1:
+                spacing = np.diff(unique_prices)
+                result['min_distance'] = float(spacing.min())
+                result['median_distance'] = float(np.median(spacing))
+                result['unique_price_count'] = len(unique_prices)
+            results.append(result)
+        return results
+
+def _summary_from_counts(columns):
+    """PriceSummary over (sorted prices, counts) per column, as a streamed upload would give"""
+    summary = PriceSummary()
+    for column, (prices, counts) in columns.items():
+        keep = counts > 0
+        summary.keys[column], summary.counts[column] = prices[keep], counts[keep].astype(np.int64)
+    return summary
+
+def _replicate_strengths(grouper, summaries):
+    """Prices, timeframe counts and weighted touches of the strong levels found in replicate summaries"""
+    grouper.price_summaries = summaries
+    grouper.price_hierarchies = {}
+    confluence = grouper.confluence_groups()
+    if confluence is None:
+        return np.empty(0), np.empty(0, dtype=np.int64), np.empty(0)
+    groups = confluence[0]
+    strong = groups['touches'] >= grouper.min_touches
+    return groups['levels'][strong], groups['timeframe_present'][strong].sum(axis=1), groups['weighted_touches'][strong]
+
+def _snap(values, tick_size):
+    return np.rint(values / tick_size) * tick_size if tick_size else values
+
+def _bootstrap_task(task):
+    """Replicates in which each level still has a strong level within its tolerance
+
+    Bars are resampled with multinomial multiplicities, drawn for the whole
+    batch at once; each column's price counts are one reduceat over the draws
+    laid out in price order.
+    """
+    grouper, series, level_prices, level_tolerances, replicates, seed = task
+    rng = np.random.default_rng(seed)
+    matched = np.zeros(len(level_prices), dtype=np.int64)
+    draws = {timeframe: rng.multinomial(bar_count, np.full(bar_count, 1.0 / bar_count), size=replicates)
+             for timeframe, (bar_count, _) in series.items()}
+    counts = {timeframe: {column: np.add.reduceat(draws[timeframe][:, bars], starts, axis=1)
+                          for column, (prices, bars, starts) in columns.items()}
+              for timeframe, (_, columns) in series.items()}
+    for replicate in range(replicates):
+        summaries = {timeframe: _summary_from_counts({column: (columns[column][0], counts[timeframe][column][replicate])
+                                                      for column in columns})
+                     for timeframe, (_, columns) in series.items()}
+        prices, _, _ = _replicate_strengths(grouper, summaries)
+        if len(prices) == 0:
+            continue
+        prices = np.sort(prices)
+        above = np.searchsorted(prices, level_prices).clip(0, len(prices) - 1)
+        below = (above - 1).clip(0, len(prices) - 1)
+        nearest = np.minimum(np.abs(prices[above] - level_prices), np.abs(prices[below] - level_prices))
+        matched += nearest <= level_tolerances
+    return 'bootstrap', replicates, matched
+
+def _null_task(task):
+    """Timeframe counts and weighted touches of the strong levels of random-walk replicates
+
+    Every timeframe becomes a geometric random walk from its first close with
+    its own log-return volatility, and each bar takes the high/low shape of a
+    randomly drawn real bar. Paths for the whole batch are one cumsum.
+    """
+    grouper, walks, replicates, seed = task
+    rng = np.random.default_rng(seed)
+    bars = {}
+    for timeframe, (start, volatility, up, down) in walks.items():
+        closes = start * np.exp(np.cumsum(rng.normal(0.0, volatility, (replicates, len(up))), axis=1))
+        shapes = rng.integers(0, len(up), (replicates, len(up)))
+        bars[timeframe] = {'High': closes * np.exp(up[shapes]), 'Low': closes * np.exp(-down[shapes])}
+        if grouper.pivot_window:
+            for column, prices in bars[timeframe].items():
+                frame = pd.DataFrame(prices.T)
+                bars[timeframe][column] = frame.where(pivot_mask(frame, column, grouper.pivot_window)).to_numpy().T
+    timeframe_counts, strengths = [], []
+    for replicate in range(replicates):
+        summaries = {}
+        for timeframe, columns in bars.items():
+            prices = {}
+            for column, values in columns.items():
+                row = _snap(values[replicate], grouper.tick_size)
+                prices[column] = np.unique(row[~np.isnan(row)], return_counts=True)
+            summaries[timeframe] = _summary_from_counts(prices)
+        _, counts, weighted = _replicate_strengths(grouper, summaries)
+        timeframe_counts.append(counts)
+        strengths.append(weighted.astype(float))
+    return 'null', replicates, (np.concatenate(timeframe_counts), np.concatenate(strengths))
+
 class MultiTimeframeSRFinder:
-    def __init__(self, timeframe_data, min_touches=2, tolerance_percentage=0.01, grouping_method="conservative", tolerance_mode="current_price"):
+    def __init__(self, timeframe_data, min_touches=2, tolerance_percentage=0.01, grouping_method="conservative", tolerance_mode="current_price", tick_size=None, density_smoothing=1, pivot_window=None, incremental=False, price_summaries=None, workers=None, volume_profile=False, atr_multiple=0.5, atr_period=ATR_PERIOD, recency_half_life_days=None, rank_by="touches", role_reversals=False, level_sources=(), source_weights=None):
         try:
             self.timeframe_data = timeframe_data
             self.min_touches = min_touches
             self.tolerance_percentage = tolerance_percentage / 100.0
             self.grouping_method = grouping_method
             self.tolerance_mode = tolerance_mode
+            self.tick_size = tick_size
+            self.density_smoothing = density_smoothing
+            self.pivot_window = pivot_window
+            self.incremental = incremental
+            self.incremental_state = None
+            self.price_summaries = price_summaries or {}
+            self.workers = workers
+            self.volume_profile = volume_profile
+            self.atr_multiple = atr_multiple
+            self.atr_period = atr_period
+            self.rank_by = rank_by
+            if rank_by == "recency" and recency_half_life_days is None:
+                recency_half_life_days = RECENCY_HALF_LIFE_DAYS
+            self.recency_half_life_days = recency_half_life_days
+            self.role_reversals = role_reversals
+            unknown_sources = [source for source in level_sources if source not in LEVEL_SOURCES]
+            if unknown_sources:
+                raise ValueError(f"Unknown level sources: {unknown_sources}")
+            self.level_sources = list(level_sources)
+            self.source_weights = source_weights or {}
             self.timeframe_weights = {'1D': 3, '4H': 2, '1H': 1}
+            self.price_hierarchies = {}
+            self.level_index = None
+            self.range_index = None
             self.prepare_data()
         except Exception as e:
             print(f"Error initializing SR Finder: {e}")
@@ -23,294 +1415,1104 @@ class MultiTimeframeSRFinder:
         
     def prepare_data(self):
         for timeframe, df in self.timeframe_data.items():
-            df_copy = df.copy()
-            
-            # Handle column mapping
-            column_mapping = {}
-            for col in df_copy.columns:
-                col_lower = col.lower()
-                if col_lower in ['open', 'o']:
-                    column_mapping[col] = 'Open'
-                elif col_lower in ['high', 'h']:
-                    column_mapping[col] = 'High'
-                elif col_lower in ['low', 'l']:
-                    column_mapping[col] = 'Low'
-                elif col_lower in ['close', 'c']:
-                    column_mapping[col] = 'Close'
-                elif col_lower in ['volume', 'vol', 'v']:
-                    column_mapping[col] = 'Volume'
-            
-            if column_mapping:
-                df_copy.rename(columns=column_mapping, inplace=True)
-            
-            required_cols = ['Open', 'High', 'Low', 'Close']
-            missing_cols = [col for col in required_cols if col not in df_copy.columns]
-            if missing_cols:
-                alt_mapping = {
-                    'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close',
-                    'o': 'Open', 'h': 'High', 'l': 'Low', 'c': 'Close'
-                }
-                for old_name, new_name in alt_mapping.items():
-                    if old_name in df_copy.columns and new_name in missing_cols:
-                        df_copy.rename(columns={old_name: new_name}, inplace=True)
-                        missing_cols.remove(new_name)
-                        
-                if missing_cols:
-                    raise ValueError(f"Missing required columns in {timeframe}: {missing_cols}")
-            
-            # df_copy.dropna(inplace=True)
-            self.timeframe_data[timeframe] = df_copy
+            self.timeframe_data[timeframe] = self.prepare_timeframe(timeframe, df)
         
-        primary_timeframe = list(self.timeframe_data.keys())[0]
-        self.current_price = self.timeframe_data[primary_timeframe]['Close'].iloc[-1]
-        self.base_tolerance = self.current_price * self.tolerance_percentage
+        self.primary_timeframe = list(self.timeframe_data.keys())[0]
+        self.current_price = self.timeframe_data[self.primary_timeframe]['Close'].iloc[-1]
+        self.atr_tolerances = {}
+        if self.tolerance_mode == "atr":
+            for timeframe, df in self.timeframe_data.items():
+                self.atr_tolerances[timeframe] = self.atr_multiple * self.timeframe_atr(timeframe, df)
+        self.base_tolerance = self.get_base_tolerance()
+        self.price_hierarchies = {}
+        self.level_index = None
+        self.range_index = None
         
         print(f"Current price: ${self.current_price:.2f}")
         print(f"Base tolerance: ${self.base_tolerance:.3f}")
         print(f"Tolerance mode: {self.tolerance_mode}")
+        self.reference_time = None
+        if self.tracks_touch_times() and self.update_reference_time() < len(self.timeframe_data):
+            print("Touch times need a Date index; undated and streamed timeframes count touches undecayed and without role flips")
+        if self.atr_tolerances:
+            print("ATR tolerances: " + ", ".join(f"{timeframe} ${tolerance:.3f}" for timeframe, tolerance in self.atr_tolerances.items()))
+        if self.price_summaries and self.pivot_window:
+            print("Pivot filter needs bar order and is skipped for streamed timeframes")
+        if self.price_summaries and self.volume_profile:
+            print("Streamed timeframes keep no volume and get no volume profile")
+        if self.price_summaries and self.level_sources:
+            print("Extra level sources need whole bars and are skipped for streamed timeframes")
+    
+    def prepare_timeframe(self, timeframe, df):
+        df_copy = df.copy()
+        
+        # Handle column mapping
+        column_mapping = {}
+        for col in df_copy.columns:
+            col_lower = col.lower()
+            if col_lower in ['open', 'o']:
+                column_mapping[col] = 'Open'
+            elif col_lower in ['high', 'h']:
+                column_mapping[col] = 'High'
+            elif col_lower in ['low', 'l']:
+                column_mapping[col] = 'Low'
+            elif col_lower in ['close', 'c']:
+                column_mapping[col] = 'Close'
+            elif col_lower in ['volume', 'vol', 'v']:
+                column_mapping[col] = 'Volume'
+        
+        if column_mapping:
+            df_copy.rename(columns=column_mapping, inplace=True)
+        
+        required_cols = ['Open', 'High', 'Low', 'Close']
+        missing_cols = [col for col in required_cols if col not in df_copy.columns]
+        if missing_cols:
+            alt_mapping = {
+                'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close',
+                'o': 'Open', 'h': 'High', 'l': 'Low', 'c': 'Close'
+            }
+            for old_name, new_name in alt_mapping.items():
+                if old_name in df_copy.columns and new_name in missing_cols:
+                    df_copy.rename(columns={old_name: new_name}, inplace=True)
+                    missing_cols.remove(new_name)
+                    
+            if missing_cols:
+                raise ValueError(f"Missing required columns in {timeframe}: {missing_cols}")
+        
+        # df_copy.dropna(inplace=True)
+        return df_copy
+    
+    def set_tolerance_percentage(self, tolerance_percentage):
+        self.tolerance_percentage = tolerance_percentage / 100.0
+        self.base_tolerance = self.get_base_tolerance()
+        self.level_index = None
+    
+    def get_base_tolerance(self, timeframe=None):
+        """Dollar tolerance of the fixed-width modes; atr mode looks up the timeframe (primary by default)"""
+        if self.tolerance_mode == "atr":
+            return self.atr_tolerances[timeframe or self.primary_timeframe]
+        return self.current_price * self.tolerance_percentage
+    
+    def timeframe_atr(self, timeframe, df):
+        """Average True Range at the last bar: the mean of the last atr_period true ranges
+
+        Only the closing window is averaged, so the result does not depend on
+        how much earlier history is kept (streamed summaries keep a short tail).
+        """
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
+        bars = df[['High', 'Low', 'Close']].iloc[-(self.atr_period + 1):].to_numpy(dtype=float)
+        high, low, close = bars[1:].T if len(bars) > self.atr_period else bars.T
+        previous_close = bars[:-1, 2] if len(bars) > self.atr_period else np.concatenate(([np.nan], close[:-1]))
+        # fmax skips the missing close before the first bar
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - previous_close), np.abs(low - previous_close)))
+        true_range = true_range[np.isfinite(true_range)]
+        if len(true_range) == 0 or true_range.mean() <= 0:
+            raise ValueError(f"ATR tolerance needs bars with a High-Low range in {timeframe}")
+        return float(true_range.mean())
+    
+    def get_candidate_prices(self, timeframe, column):
+        prices = self.timeframe_data[timeframe][column]
+        if not self.pivot_window:
+            return prices
+        return prices[pivot_mask(prices, column, self.pivot_window)]
+    
+    def get_price_hierarchy(self, timeframe, column):
+        key = (timeframe, column)
+        if key not in self.price_hierarchies:
+            if timeframe in self.price_summaries:
+                values, counts = self.price_summaries[timeframe].price_counts(column)
+                self.price_hierarchies[key] = PriceHierarchy(values, presorted=True, counts=counts)
+            else:
+                self.price_hierarchies[key] = PriceHierarchy(self.get_candidate_prices(timeframe, column), tick_size=self.tick_size)
+        return self.price_hierarchies[key]
+    
+    def supports_incremental(self):
+        # ATR tolerances move with every bar, so atr mode recomputes
+        return (self.grouping_method in ("conservative", "aggressive", "optimal") and not self.pivot_window
+                and not self.volume_profile and self.tolerance_mode != "atr" and not self.tracks_touch_times()
+                and not self.level_sources)
+    
+    def hard_breaks(self, sorted_prices):
+        """Gaps wider than any tolerance the current settings can apply"""
+        gaps = np.diff(sorted_prices)
+        previous = sorted_prices[:-1]
+        if self.tolerance_mode in FIXED_TOLERANCE_MODES:
+            bound = np.full(len(gaps), self.base_tolerance)
+        else:
+            bound = previous * self.tolerance_percentage
+        return gaps > bound + (np.abs(bound) + np.abs(previous)) * HARD_BREAK_SLACK
+    
+    def incremental_settings(self):
+        base_tolerance = self.base_tolerance if self.tolerance_mode in FIXED_TOLERANCE_MODES else None
+        return (self.grouping_method, self.tolerance_mode, self.tolerance_percentage, base_tolerance, self.tick_size)
+    
+    def get_incremental_state(self):
+        state = self.incremental_state
+        if state is not None and state['settings'] == self.incremental_settings():
+            return state
+        
+        timeframe_names = list(self.timeframe_data.keys())
+        confluence = ConfluenceState(self, np.array(LEVEL_TYPES), timeframe_names)
+        series = {}
+        for timeframe_code, timeframe in enumerate(timeframe_names):
+            df = self.timeframe_data[timeframe]
+            if df is None or df.empty:
+                continue
+            weight = self.timeframe_weights.get(timeframe, 1)
+            for column, level_type in LEVEL_COLUMNS:
+                series_state = IncrementalSeries(self.get_price_hierarchy(timeframe, column), self.group_starts,
+                                                 self.hard_breaks, self.tick_size)
+                series_code = len(series)
+                series[(timeframe, column)] = (series_code, series_state)
+                confluence.replace_series_levels(series_code, np.empty(0), series_state.levels, series_state.touches,
+                                                 weight, LEVEL_TYPES.index(level_type), timeframe_code)
+        
+        self.incremental_state = {'settings': self.incremental_settings(), 'series': series, 'confluence': confluence}
+        return self.incremental_state
+    
+    def append_bars(self, timeframe, bars):
+        """Append new rows to one timeframe, regrouping only the affected price ranges
+
+        Without incremental=True, or for settings whose groups cannot be updated
+        in place (density grouping, pivot filtering, or a current_price tolerance
+        that moved with the latest close), the next request recomputes in full.
+        """
+        bars = self.prepare_timeframe(timeframe, bars)
+        new_timeframe = timeframe not in self.timeframe_data
+        existing = self.timeframe_data.get(timeframe)
+        self.timeframe_data[timeframe] = bars if existing is None else pd.concat([existing, bars])
+        if timeframe in self.price_summaries:
+            self.price_summaries[timeframe].add(bars)
+        self.refresh_timeframe(timeframe, added=bars, new_timeframe=new_timeframe)
+    
+    def remove_bars(self, timeframe, count):
+        """Drop the oldest rows of one timeframe, regrouping like append_bars"""
+        if timeframe in self.price_summaries:
+            raise ValueError(f"Bars cannot be removed from streamed timeframe {timeframe}")
+        df = self.timeframe_data[timeframe]
+        self.timeframe_data[timeframe] = df.iloc[count:]
+        self.refresh_timeframe(timeframe, removed=df.iloc[:count])
+    
+    def refresh_timeframe(self, timeframe, added=None, removed=None, new_timeframe=False):
+        """Bring cached state in line after rows of timeframe_data[timeframe] were added or removed"""
+        self.price_hierarchies = {key: value for key, value in self.price_hierarchies.items() if key[0] != timeframe}
+        self.level_index = None
+        self.range_index = None
+        
+        if timeframe == list(self.timeframe_data.keys())[0] and not self.timeframe_data[timeframe].empty:
+            self.current_price = self.timeframe_data[timeframe]['Close'].iloc[-1]
+        if self.tolerance_mode == "atr" and not self.timeframe_data[timeframe].empty:
+            self.atr_tolerances[timeframe] = self.atr_multiple * self.timeframe_atr(timeframe, self.timeframe_data[timeframe])
+        self.base_tolerance = self.get_base_tolerance()
+        if self.tracks_touch_times():
+            self.update_reference_time()
+        
+        state = self.incremental_state
+        if (state is None or new_timeframe or not self.supports_incremental()
+                or state['settings'] != self.incremental_settings()):
+            self.incremental_state = None
+            return
+        
+        weight = self.timeframe_weights.get(timeframe, 1)
+        timeframe_code = list(self.timeframe_data.keys()).index(timeframe)
+        for column, level_type in LEVEL_COLUMNS:
+            series_code, series_state = state['series'].get((timeframe, column), (None, None))
+            if series_state is None:
+                continue
+            updates = []
+            if removed is not None and len(removed):
+                updates.append((series_state.remove, removed[column]))
+            if added is not None and len(added):
+                updates.append((series_state.insert, added[column]))
+            for update, prices in updates:
+                old_levels = series_state.levels
+                change = update(prices)
+                if change is None:
+                    continue
+                first_group, old_end, new_end = change
+                state['confluence'].replace_series_levels(
+                    series_code, old_levels[first_group:old_end], series_state.levels[first_group:new_end],
+                    series_state.touches[first_group:new_end], weight, LEVEL_TYPES.index(level_type), timeframe_code)
+    
+    def rolling_levels(self, window_bars, step=1, changes_only=False):
+        """Levels as of each bar of the primary timeframe, using only the trailing window
+
+        The window holds the last window_bars primary bars and the rows of every
+        other timeframe dated inside that span. Sliding it inserts the entering
+        highs/lows and removes the departing ones instead of regrouping from
+        scratch. Yields (date, levels) with levels as from
+        combine_multi_timeframe_levels, or (date, added, removed) when
+        changes_only is set, keyed on level price and type.
+
+        In current_price mode the tolerance follows each step's close, so every
+        step regroups in full; level_price and log_price update incrementally.
+        """
+        timeframe_names = list(self.timeframe_data.keys())
+        frames = {}
+        for timeframe in timeframe_names:
+            df = self.timeframe_data[timeframe]
+            frames[timeframe] = df if df.index.is_monotonic_increasing else df.sort_index()
+        dates = frames[timeframe_names[0]].index
+        if len(dates) < window_bars:
+            return
+        
+        def window_bounds(end):
+            first_date, last_date = dates[end - window_bars], dates[end - 1]
+            return {timeframe: (int(frames[timeframe].index.searchsorted(first_date, side='left')),
+                                int(frames[timeframe].index.searchsorted(last_date, side='right')))
+                    for timeframe in timeframe_names}
+        
+        bounds = window_bounds(window_bars)
+        window = MultiTimeframeSRFinder({timeframe: frames[timeframe].iloc[lo:hi] for timeframe, (lo, hi) in bounds.items()},
+                                        self.min_touches, self.tolerance_percentage * 100, self.grouping_method,
+                                        self.tolerance_mode, self.tick_size, self.density_smoothing, self.pivot_window,
+                                        incremental=True, volume_profile=self.volume_profile,
+                                        atr_multiple=self.atr_multiple, atr_period=self.atr_period,
+                                        recency_half_life_days=self.recency_half_life_days, rank_by=self.rank_by,
+                                        role_reversals=self.role_reversals, level_sources=self.level_sources,
+                                        source_weights=self.source_weights)
+        window.timeframe_weights = self.timeframe_weights
+        
+        previous = {}
+        for end in range(window_bars, len(dates) + 1, step):
+            if end > window_bars:
+                new_bounds = window_bounds(end)
+                # Primary timeframe last so the current price is set once every row is in place
+                for timeframe in timeframe_names[1:] + timeframe_names[:1]:
+                    (old_lo, old_hi), (lo, hi) = bounds[timeframe], new_bounds[timeframe]
+                    frame = frames[timeframe]
+                    window.timeframe_data[timeframe] = frame.iloc[lo:hi]
+                    window.refresh_timeframe(timeframe, added=frame.iloc[max(old_hi, lo):hi],
+                                             removed=frame.iloc[old_lo:min(lo, old_hi)])
+                bounds = new_bounds
+            
+            levels = window.combine_multi_timeframe_levels()
+            if not changes_only:
+                yield dates[end - 1], levels
+                continue
+            current = {(level['level'], level['type']): level for level in levels}
+            added = [level for key, level in current.items() if previous.get(key) != level]
+            removed = [level for key, level in previous.items() if current.get(key) != level]
+            previous = current
+            yield dates[end - 1], added, removed
+    
+    def get_log_tolerance(self):
+        """Fixed log-space gap used by tolerance_mode="log_price"
+
+        Prices p < q are within tolerance when log(q) - log(p) <= log(1 + pct),
+        i.e. q - p <= pct * p. level_price instead scales the tolerance by the
+        running group mean (conservative) or centroid (aggressive), so the two
+        modes only disagree on where a group is measured from:
+        - conservative: the group mean lies between the group's low and the
+          previous price, so the log-mode tolerance is never tighter and exceeds
+          the level_price one by at most pct * (group high - group low).
+        - aggressive: the centroid becomes the geometric mean G instead of the
+          arithmetic mean A, and 0 <= A - G <= spread**2 / (8 * group low), so the
+          acceptance bound A * (1 + pct) moves by at most (1 + pct) times that.
+        Both differences are second order for groups a few tolerances wide.
+        """
+        return np.log1p(self.tolerance_percentage)
     
     def get_tolerance_for_price(self, price):
-        if self.tolerance_mode == "current_price":
+        if self.tolerance_mode in FIXED_TOLERANCE_MODES:
             return self.base_tolerance
         else:
             return price * self.tolerance_percentage
     
-    def group_prices_conservative(self, prices, level_type, timeframe, weight):
-        if not prices or len(prices) == 0:
-            return []
+    def get_tolerances_for_prices(self, prices):
+        if self.tolerance_mode in FIXED_TOLERANCE_MODES:
+            return np.full(len(prices), self.base_tolerance)
+        return prices * self.tolerance_percentage
+    
+    def conservative_starts(self, hierarchy):
+        if self.tolerance_mode == "level_price":
+            return conservative_group_starts(hierarchy.sorted_prices, self.base_tolerance, self.tolerance_percentage, hierarchy.counts)
+        elif self.tolerance_mode == "log_price":
+            return hierarchy.log_hierarchy().cut(self.get_log_tolerance())
+        else:
+            return hierarchy.cut(self.base_tolerance)
+    
+    def aggressive_starts(self, hierarchy):
+        if self.tolerance_mode == "level_price":
+            return aggressive_group_starts(hierarchy.sorted_prices, self.base_tolerance, self.tolerance_percentage, hierarchy.counts)
+        elif self.tolerance_mode == "log_price":
+            return aggressive_group_starts(hierarchy.log_hierarchy().sorted_prices, self.get_log_tolerance(),
+                                           counts=hierarchy.counts)
+        else:
+            return aggressive_group_starts(hierarchy.sorted_prices, self.base_tolerance, counts=hierarchy.counts)
+    
+    def optimal_starts(self, hierarchy):
+        if self.tolerance_mode in FIXED_TOLERANCE_MODES:
+            return optimal_group_starts(hierarchy.sorted_prices, self.base_tolerance, hierarchy.counts)
+        else:
+            return optimal_group_starts(hierarchy.log_hierarchy().sorted_prices, self.get_log_tolerance(), hierarchy.counts)
+    
+    def group_starts(self, hierarchy, method=None):
+        """Group starts of the hierarchy by method, the finder's grouping_method by default"""
+        method = method or self.grouping_method
+        if self.workers and self.workers > 1 and len(hierarchy) >= SHARD_MIN_PRICES:
+            return self.sharded_group_starts(hierarchy, method)
+        if method == "conservative":
+            return self.conservative_starts(hierarchy)
+        elif method == "optimal":
+            return self.optimal_starts(hierarchy)
+        else:
+            return self.aggressive_starts(hierarchy)
+    
+    def shard_cuts(self, sorted_prices, shard_count):
+        """Shard boundaries near equal shares of the series
+
+        Optimal grouping can only be cut at hard breaks; the walks can be cut anywhere.
+        """
+        targets = np.linspace(0, len(sorted_prices), shard_count + 1)[1:-1].astype(np.int64)
+        if self.grouping_method != "optimal":
+            return np.unique(targets[targets > 0])
+        breaks = np.flatnonzero(self.hard_breaks(sorted_prices)) + 1
+        if len(breaks) == 0:
+            return breaks
+        nearest = np.clip(np.searchsorted(breaks, targets), 0, len(breaks) - 1)
+        return np.unique(breaks[nearest])
+    
+    def sharded_group_starts(self, hierarchy, method=None):
+        """group_starts over price-ordered shards on a process pool, stitched with PartialLevels.merge"""
+        method = method or self.grouping_method
+        unsharded = self.unsharded()
+        unsharded.grouping_method = method
+        cuts = unsharded.shard_cuts(hierarchy.sorted_prices, self.workers)
+        if len(cuts) == 0:
+            return unsharded.group_starts(hierarchy)
+        bounds = np.concatenate(([0], cuts, [len(hierarchy)])).tolist()
+        grouper = unsharded.group_starts
+        tasks = [(grouper, hierarchy.sorted_prices[start:end],
+                  None if hierarchy.counts is None else hierarchy.counts[start:end])
+                 for start, end in zip(bounds[:-1], bounds[1:])]
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up_walks) as pool:
+            shard_starts = list(pool.map(_shard_group_starts, tasks))
+        
+        seam_grouper = None if method == "optimal" else grouper
+        merged = PartialLevels(np.empty(0), None if hierarchy.counts is None else np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        for (_, sorted_prices, counts), starts in zip(tasks, shard_starts):
+            merged = merged.merge(PartialLevels(sorted_prices, counts, starts), seam_grouper)
+        return merged.starts
+    
+    def significance_inputs(self):
+        """Per-timeframe bootstrap series and random-walk parameters for the significance stage
+
+        Bootstrap series: bar count plus, per column, the unique candidate
+        prices, the bar of every touch in price order and where each price's
+        touches start. Walks: first close, log-return volatility and the log
+        high/low offsets of every bar from its close (NaN where missing).
+        """
+        series, walks = {}, {}
+        for timeframe, df in self.timeframe_data.items():
+            if df is None or df.empty:
+                continue
+            columns = {}
+            for column, _ in LEVEL_COLUMNS:
+                prices = df[column]
+                values = prices.to_numpy(dtype=float, na_value=np.nan)
+                mask = ~np.isnan(values)
+                if self.pivot_window:
+                    mask &= pivot_mask(prices, column, self.pivot_window).to_numpy()
+                bars = np.flatnonzero(mask)
+                values = _snap(values[mask], self.grouping_tick_size())
+                order = np.argsort(values, kind='stable')
+                unique_prices, starts = np.unique(values[order], return_index=True)
+                columns[column] = (unique_prices, bars[order], starts)
+            series[timeframe] = (len(df), columns)
+            
+            ordered = time_ordered(df)
+            high, low, close = (ordered[column].to_numpy(dtype=float) for column in ('High', 'Low', 'Close'))
+            valid = close > 0
+            if valid.sum() < 2:
+                raise ValueError(f"Significance needs positive closes in {timeframe}")
+            high, low, close = high[valid], low[valid], close[valid]
+            # Missing or bad highs/lows stay NaN, so the walk has no touch there either
+            shaped = ~(high < low)
+            high = np.where(shaped & (high > 0), high, np.nan)
+            low = np.where(shaped & (low > 0), low, np.nan)
+            walks[timeframe] = (close[0], float(np.std(np.diff(np.log(close)))), np.log(high / close), np.log(close / low))
+        return series, walks
+    
+    def significance_grouper(self):
+        """Settings-only copy that regroups replicate price summaries into High/Low confluence levels"""
+        grouper = self.unsharded()
+        grouper.timeframe_data = {timeframe: df.iloc[-1:][['High', 'Low', 'Close']]
+                                  for timeframe, df in self.timeframe_data.items() if df is not None and not df.empty}
+        grouper.incremental = False
+        grouper.volume_profile = False
+        grouper.level_sources = []
+        grouper.role_reversals = False
+        grouper.recency_half_life_days = None
+        grouper.tick_size = self.grouping_tick_size()
+        return grouper
+    
+    def add_significance(self, levels, bootstrap_samples=200, null_samples=200, time_budget=SIGNIFICANCE_TIME_BUDGET,
+                         workers=None, seed=None):
+        """Add a bootstrap confidence and a random-walk p_value to strong level dicts, in place
+
+        confidence: share of bar-resampled replicates, regrouped with the same
+        settings, that still have a strong level within the level's tolerance.
+        p_value: share of the strong levels of random-walk replicates (matched
+        volatility and bar ranges) at least as strong as this one by the
+        ranking order (timeframe count, then weighted touches), with the usual
+        +1 correction. Only High/Low touches are resampled.
+        Replicates run in batches, on a process pool with workers > 1, until
+        time_budget seconds have passed; the counts that finished are returned.
+        """
+        info = {'bootstrap_samples': 0, 'null_samples': 0, 'time_budget': time_budget}
+        for level in levels:
+            level['confidence'] = None
+            level['p_value'] = None
+        if not levels or self.price_summaries:
+            if self.price_summaries:
+                print("Significance needs whole bars and is skipped with streamed timeframes")
+            return info
+        
+        series, walks = self.significance_inputs()
+        grouper = self.significance_grouper()
+        level_prices = np.array([level['level'] for level in levels], dtype=float)
+        level_tolerances = self.get_tolerances_for_prices(level_prices)
+        timeframe_counts = np.array([level['timeframe_count'] for level in levels], dtype=float)
+        strengths = np.array([level['weighted_touches'] for level in levels], dtype=float)
+        
+        longest = max(bar_count for bar_count, _ in series.values())
+        batch = int(np.clip(SIGNIFICANCE_BATCH_CELLS // longest, 1, 25))
+        bootstrap_batches = [min(batch, bootstrap_samples - start) for start in range(0, bootstrap_samples, batch)]
+        null_batches = [min(batch, null_samples - start) for start in range(0, null_samples, batch)]
+        # Alternate the two kinds so a budget cut leaves both with samples
+        tasks = []
+        for i in range(max(len(bootstrap_batches), len(null_batches))):
+            if i < len(bootstrap_batches):
+                tasks.append((_bootstrap_task, [grouper, series, level_prices, level_tolerances, bootstrap_batches[i]]))
+            if i < len(null_batches):
+                tasks.append((_null_task, [grouper, walks, null_batches[i]]))
+        for (_, task), child_seed in zip(tasks, np.random.SeedSequence(seed).spawn(len(tasks))):
+            task.append(child_seed)
         
+        matched = np.zeros(len(levels), dtype=np.int64)
+        null_levels = []
+        for kind, replicates, values in self.run_significance_tasks(tasks, time_budget, workers):
+            if kind == 'bootstrap':
+                info['bootstrap_samples'] += replicates
+                matched += values
+            else:
+                info['null_samples'] += replicates
+                null_levels.append(values)
+        
+        if info['bootstrap_samples']:
+            for level, confidence in zip(levels, (matched / info['bootstrap_samples']).tolist()):
+                level['confidence'] = confidence
+        if null_levels:
+            null_counts = np.concatenate([counts for counts, _ in null_levels]).astype(float)
+            null_strengths = np.concatenate([weighted for _, weighted in null_levels])
+            # One sortable key: timeframe count first, weighted touches (>= 0) within it
+            scale = max(null_strengths.max(initial=0), strengths.max()) + 1
+            null_keys = np.sort(null_counts * scale + null_strengths)
+            at_least = len(null_keys) - np.searchsorted(null_keys, timeframe_counts * scale + strengths, side='left')
+            for level, p_value in zip(levels, ((1 + at_least) / (1 + len(null_keys))).tolist()):
+                level['p_value'] = p_value
+        return info
+    
+    def run_significance_tasks(self, tasks, time_budget, workers=None):
+        """Results of the (function, task) pairs that finish within time_budget seconds
+
+        On a pool (at most SIGNIFICANCE_MAX_WORKERS processes) batches still
+        running at the deadline are killed with the pool. In-process, no batch
+        starts after the deadline, but a running one finishes.
+        """
+        workers = min(workers or 1, SIGNIFICANCE_MAX_WORKERS, len(tasks))
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, initializer=warm_up_walks)
+            try:
+                deadline = time.perf_counter() + time_budget
+                pending = [pool.apply_async(function, (tuple(task),)) for function, task in tasks]
+                results = []
+                for result in pending:
+                    result.wait(max(0.0, deadline - time.perf_counter()))
+                    if result.ready():
+                        results.append(result.get())
+                return results
+            finally:
+                pool.terminate()
+                pool.join()
+        
+        deadline = time.perf_counter() + time_budget
+        results = []
+        for function, task in tasks:
+            if time.perf_counter() >= deadline:
+                break
+            results.append(function(tuple(task)))
+        return results
+    
+    def unsharded(self):
+        """Copy carrying only the grouping settings, cheap to send to pool workers"""
+        grouper = copy.copy(self)
+        grouper.timeframe_data = {}
+        grouper.price_hierarchies = {}
+        grouper.price_summaries = {}
+        grouper.incremental_state = None
+        grouper.workers = None
+        return grouper
+    
+    def group_prices_conservative(self, prices, level_type, timeframe, weight):
+        return self.group_prices_segments(prices, "conservative", level_type, timeframe, weight)
+    
+    def group_prices_aggressive(self, prices, level_type, timeframe, weight):
+        return self.group_prices_segments(prices, "aggressive", level_type, timeframe, weight)
+    
+    def group_prices_optimal(self, prices, level_type, timeframe, weight):
+        return self.group_prices_segments(prices, "optimal", level_type, timeframe, weight)
+    
+    def group_prices_segments(self, prices, method, level_type, timeframe, weight):
         try:
-            sorted_prices = sorted([p for p in prices if p is not None and not pd.isna(p)])
-            if not sorted_prices:
+            hierarchy = prices if isinstance(prices, PriceHierarchy) else PriceHierarchy(prices, tick_size=self.tick_size)
+            if len(hierarchy) == 0:
                 return []
-                
-            groups = []
-            current_group = [sorted_prices[0]]
             
-            for price in sorted_prices[1:]:
-                if self.tolerance_mode == "level_price":
-                    group_avg = sum(current_group) / len(current_group)
-                    tolerance = self.get_tolerance_for_price(group_avg)
-                else:
-                    tolerance = self.base_tolerance
-                
-                min_distance = min(abs(price - group_price) for group_price in current_group)
-                
-                if min_distance <= tolerance:
-                    current_group.append(price)
-                else:
-                    if len(current_group) >= 1:
-                        groups.append(current_group.copy())
-                    current_group = [price]
-            
-            if len(current_group) >= 1:
-                groups.append(current_group)
-            
-            return self.convert_groups_to_levels(groups, level_type, timeframe, weight)
+            return self.segment_level_batch(hierarchy, level_type, timeframe, weight, method).to_dicts()
         
         except Exception as e:
-            print(f"Error in conservative grouping: {e}")
+            print(f"Error in {method} grouping: {e}")
             return []
     
-    def group_prices_aggressive(self, prices, level_type, timeframe, weight):
-        if not prices or len(prices) == 0:
-            return []
-        
+    def group_prices_density(self, prices, level_type, timeframe, weight, counts=None):
         try:
-            sorted_prices = sorted([p for p in prices if p is not None and not pd.isna(p)])
-            if not sorted_prices:
+            values = finite_price_array(prices)
+            if len(values) == 0:
                 return []
-                
-            groups = []
-            current_group = [sorted_prices[0]]
-            
-            for price in sorted_prices[1:]:
-                group_center = sum(current_group) / len(current_group)
-                
-                if self.tolerance_mode == "level_price":
-                    tolerance = self.get_tolerance_for_price(group_center)
-                else:
-                    tolerance = self.base_tolerance
-                
-                if abs(price - group_center) <= tolerance:
-                    current_group.append(price)
-                else:
-                    if len(current_group) >= 1:
-                        groups.append(current_group.copy())
-                    current_group = [price]
             
-            if len(current_group) >= 1:
-                groups.append(current_group)
-            
-            return self.convert_groups_to_levels(groups, level_type, timeframe, weight)
+            return self.density_level_batch(values, counts, level_type, timeframe, weight).to_dicts()
         
         except Exception as e:
-            print(f"Error in aggressive grouping: {e}")
+            print(f"Error in density grouping: {e}")
             return []
     
-    def convert_groups_to_levels(self, groups, level_type, timeframe, weight):
-        levels = []
-        for group in groups:
-            if len(group) >= 1:
-                if len(group) >= 3:
-                    level_price = np.median(group)
-                else:
-                    level_price = sum(group) / len(group)
-                
-                tolerance_used = self.get_tolerance_for_price(level_price)
-                
-                levels.append({
-                    'level': level_price,
-                    'type': level_type,
-                    'touches': len(group),
-                    'timeframe': timeframe,
-                    'weight': weight,
-                    'weighted_touches': len(group) * weight,
-                    'original_prices': group,
-                    'price_range': f"${min(group):.2f}-${max(group):.2f}" if len(group) > 1 else f"${group[0]:.2f}",
-                    'tolerance_used': tolerance_used,
-                    'price_spread': max(group) - min(group) if len(group) > 1 else 0
-                })
+    def density_level_batch(self, values, counts, level_type, timeframe, weight):
+        if self.tolerance_mode in FIXED_TOLERANCE_MODES:
+            basins = DensityBasins(values, self.base_tolerance, self.density_smoothing, counts)
+            level_prices, lows, highs = basins.peak_means, basins.lows, basins.highs
+        else:
+            if values.min() <= 0:
+                raise ValueError(f"{self.tolerance_mode} tolerance mode requires positive prices")
+            basins = DensityBasins(np.log(values), self.get_log_tolerance(), self.density_smoothing, counts)
+            level_prices, lows, highs = np.exp(basins.peak_means), np.exp(basins.lows), np.exp(basins.highs)
         
-        return levels
+        # Basins are price ranges, so ordering by basin keeps each group contiguous
+        order = np.argsort(basins.basin_of_value, kind='stable')
+        basin_sizes = np.bincount(basins.basin_of_value, minlength=len(basins.touches))
+        starts = np.concatenate(([0], np.cumsum(basin_sizes)[:-1])).astype(np.int64)
+        return LevelBatch(values[order], None if counts is None else counts[order], starts, level_prices,
+                          basins.touches, lows, highs, self.get_tolerances_for_prices(level_prices),
+                          level_type, timeframe, weight)
+    
+    def segment_level_batch(self, hierarchy, level_type, timeframe, weight, method=None):
+        starts = self.group_starts(hierarchy, method)
+        level_prices, sizes, lows, highs = segment_levels(hierarchy.sorted_prices, starts, hierarchy.counts)
+        return LevelBatch(hierarchy.sorted_prices, hierarchy.counts, starts, level_prices, sizes.astype(np.int64),
+                          lows, highs, self.get_tolerances_for_prices(level_prices), level_type, timeframe, weight)
     
     def find_levels_for_timeframe(self, timeframe, df):
+        return [level for batch in self.find_level_batches_for_timeframe(timeframe, df) for level in batch.to_dicts()]
+    
+    def find_level_batches_for_timeframe(self, timeframe, df):
+        """Resistance and support LevelBatch of one timeframe, plus volume nodes and extra level sources"""
         weight = self.timeframe_weights.get(timeframe, 1)
         
         if df is None or df.empty:
             print(f"Warning: No data for timeframe {timeframe}")
             return []
         
+        counts = {}
         try:
-            high_prices = df['High'].dropna().tolist()
-            low_prices = df['Low'].dropna().tolist()
+            if self.grouping_method == "density" and timeframe in self.price_summaries:
+                series = {}
+                for column, _ in LEVEL_COLUMNS:
+                    series[column], counts[column] = self.price_summaries[timeframe].price_counts(column)
+            elif self.grouping_method == "density":
+                series = {column: finite_price_array(self.get_candidate_prices(timeframe, column)) for column, _ in LEVEL_COLUMNS}
+            else:
+                series = {column: self.get_price_hierarchy(timeframe, column) for column, _ in LEVEL_COLUMNS}
         except KeyError as e:
             print(f"Error: Missing column in {timeframe}: {e}")
             return []
         
-        if not high_prices or not low_prices:
+        if any(len(prices) == 0 for prices in series.values()):
             print(f"Warning: No price data found for {timeframe}")
             return []
         
+        if self.tolerance_mode != "atr":
+            return self.group_timeframe_series(timeframe, series, counts, weight)
+        # atr mode groups each timeframe with its own tolerance
+        saved_tolerance = self.base_tolerance
+        self.base_tolerance = self.get_base_tolerance(timeframe)
         try:
-            if self.grouping_method == "conservative":
-                resistance_levels = self.group_prices_conservative(high_prices, 'Resistance', timeframe, weight)
-                support_levels = self.group_prices_conservative(low_prices, 'Support', timeframe, weight)
-            else:
-                resistance_levels = self.group_prices_aggressive(high_prices, 'Resistance', timeframe, weight)
-                support_levels = self.group_prices_aggressive(low_prices, 'Support', timeframe, weight)
-        except Exception as e:
-            print(f"Error in grouping for {timeframe}: {e}")
-            return []
+            return self.group_timeframe_series(timeframe, series, counts, weight)
+        finally:
+            self.base_tolerance = saved_tolerance
+    
+    def group_timeframe_series(self, timeframe, series, counts, weight):
+        """LevelBatches of one timeframe's High/Low series at the current base tolerance"""
+        batches = []
+        for column, level_type in LEVEL_COLUMNS:
+            try:
+                if self.grouping_method == "density":
+                    batch = self.density_level_batch(series[column], counts.get(column), level_type, timeframe, weight)
+                else:
+                    batch = self.segment_level_batch(series[column], level_type, timeframe, weight)
+            except Exception as e:
+                print(f"Error in {self.grouping_method} grouping: {e}")
+                continue
+            if self.tracks_touch_times():
+                self.add_touch_times(batch, timeframe, column)
+            batches.append(batch)
         
-        all_levels = (resistance_levels or []) + (support_levels or [])
-        return all_levels
+        if self.volume_profile and timeframe not in self.price_summaries:
+            try:
+                batch = self.volume_level_batch(timeframe, weight)
+            except Exception as e:
+                print(f"Error in volume profile: {e}")
+                batch = None
+            if batch is not None:
+                batches.append(batch)
+        
+        if timeframe not in self.price_summaries:
+            for source in self.level_sources:
+                try:
+                    batch = self.source_level_batch(source, timeframe, weight)
+                except Exception as e:
+                    print(f"Error in {source} levels: {e}")
+                    batch = None
+                if batch is not None:
+                    batches.append(batch)
+        return batches
+    
+    def source_level_batch(self, source, timeframe, weight):
+        """Levels of one extra source: its candidate prices grouped like bar highs and lows"""
+        level_type, candidate_prices, default_weight = LEVEL_SOURCES[source]
+        values = finite_price_array(candidate_prices(self.timeframe_data[timeframe]))
+        if len(values) == 0:
+            return None
+        source_weight = weight * self.source_weights.get(source, default_weight)
+        if self.grouping_method == "density":
+            batch = self.density_level_batch(values, None, level_type, timeframe, source_weight)
+        else:
+            batch = self.segment_level_batch(PriceHierarchy(values, tick_size=self.tick_size), level_type, timeframe, source_weight)
+        if self.tracks_touch_times():
+            self.set_undated_touch_times(batch)
+        return batch
+    
+    def bar_times(self, index):
+        """Bar timestamps as int64 nanoseconds, None without a Date index"""
+        if not isinstance(index, pd.DatetimeIndex):
+            return None
+        return index.values.astype('datetime64[ns]').astype(np.int64)
+    
+    def update_reference_time(self):
+        """Set reference_time to the latest bar time of the dated timeframes; returns how many are dated"""
+        dated = [self.bar_times(df.index) for timeframe, df in self.timeframe_data.items()
+                 if timeframe not in self.price_summaries]
+        dated = [times for times in dated if times is not None and len(times)]
+        self.reference_time = max(int(times.max()) for times in dated) if dated else None
+        return len(dated)
+    
+    def grouping_tick_size(self):
+        """Tick grid the grouping snaps bar prices to; density grouping bins raw prices"""
+        return None if self.grouping_method == "density" else self.tick_size
+    
+    def tracks_touch_times(self):
+        """Whether levels carry touch timestamps, for recency weighting or role reversals"""
+        return bool(self.recency_half_life_days or self.role_reversals)
     
-    def combine_multi_timeframe_levels(self):
-        all_levels = []
+    def recency_half_life(self):
+        if not self.recency_half_life_days:
+            return None
+        return self.recency_half_life_days * 86_400 * 1e9
+    
+    def set_undated_touch_times(self, batch):
+        batch.first_touches, batch.last_touches, decayed_touches = undated_touch_times(batch.touches)
+        batch.decayed_touches = decayed_touches if self.recency_half_life_days else None
+    
+    def add_touch_times(self, batch, timeframe, column):
+        """Touch timestamps, first/last touch and decayed touch count of each level of a High/Low batch"""
+        prices = self.get_candidate_prices(timeframe, column)
+        times = None if timeframe in self.price_summaries or self.reference_time is None else self.bar_times(prices.index)
+        if times is None:
+            self.set_undated_touch_times(batch)
+            return
+        values = prices.to_numpy(dtype=float, na_value=np.nan)
+        finite = ~np.isnan(values)
+        values, times = values[finite], times[finite]
+        values = _snap(values, self.grouping_tick_size())
+        # Levels are disjoint price ranges, so they split halfway between neighbours
+        boundaries = (batch.highs[:-1] + batch.lows[1:]) / 2
+        batch.touch_times, batch.touch_starts = touch_segments(values, times, boundaries)
+        batch.first_touches, batch.last_touches, batch.decayed_touches = touch_time_reductions(
+            batch.touch_times, batch.touch_starts, self.reference_time, self.recency_half_life())
+    
+    def volume_level_batch(self, timeframe, weight):
+        """High-volume nodes of one timeframe; each node weighs weight times its volume over the mean node volume"""
+        df = self.timeframe_data[timeframe]
+        if 'Volume' not in df.columns:
+            print(f"Warning: No Volume column in {timeframe}, volume profile skipped")
+            return None
+        lows = df['Low'].to_numpy(dtype=float)
+        highs = df['High'].to_numpy(dtype=float)
+        volumes = df['Volume'].to_numpy(dtype=float)
+        keep = np.isfinite(lows) & np.isfinite(highs) & np.isfinite(volumes) & (volumes > 0) & (highs >= lows)
+        if not keep.any():
+            return None
+        lows, highs, volumes = lows[keep], highs[keep], volumes[keep]
+        times = self.bar_times(df.index) if self.recency_half_life_days and self.reference_time is not None else None
+        decay = None if times is None else np.exp2((times[keep] - self.reference_time) / self.recency_half_life())
+        
+        if self.tolerance_mode in FIXED_TOLERANCE_MODES:
+            profile = VolumeProfile(lows, highs, volumes, self.base_tolerance, self.density_smoothing, decay)
+            to_price = np.asarray
+        else:
+            if lows.min() <= 0:
+                raise ValueError(f"{self.tolerance_mode} tolerance mode requires positive prices")
+            profile = VolumeProfile(np.log(lows), np.log(highs), volumes, self.get_log_tolerance(), self.density_smoothing, decay)
+            to_price = np.exp
+        if len(profile) == 0:
+            return None
+        
+        level_prices = to_price(profile.levels)
+        weights = weight * profile.volumes / profile.volumes.mean()
+        batch = LevelBatch(to_price(profile.bin_prices(profile.node_bins)), None, profile.node_starts, level_prices,
+                           profile.touches, to_price(profile.lows), to_price(profile.highs),
+                           self.get_tolerances_for_prices(level_prices), 'Volume', timeframe, weights)
+        if self.tracks_touch_times():
+            # Nodes are ranges crossed by bars rather than touched prices: decay only
+            self.set_undated_touch_times(batch)
+            if profile.decayed_touches is not None:
+                batch.decayed_touches = profile.decayed_touches
+        return batch
+    
+    def combine_multi_timeframe_levels(self, top_n=None, offset=0):
+        """Strong levels strongest first; with top_n only levels offset..offset+top_n are built"""
+        confluence = self.confluence_groups()
+        if confluence is None:
+            return []
+        return self.build_strong_levels(*confluence, top_n, offset)
+    
+    def iter_strong_levels(self, page_size=LEVEL_PAGE_SIZE):
+        """Strong levels in pages of page_size, each built only when the caller asks for it"""
+        confluence = self.confluence_groups()
+        if confluence is None:
+            return
+        strong = self.strong_level_indices(confluence[0])
+        for start in range(0, len(strong), page_size):
+            yield self.format_strong_levels(*confluence, strong[start:start + page_size])
+    
+    def count_strong_levels(self, groups):
+        return int(np.count_nonzero(groups['touches'] >= self.min_touches))
+    
+    def confluence_groups(self):
+        """(groups, type names, timeframe names) of the confluence step, or None without levels"""
+        if self.incremental and self.supports_incremental():
+            confluence = self.get_incremental_state()['confluence']
+            return confluence.groups, confluence.type_names, confluence.timeframe_names
+        
+        series = []
+        batches = []
+        for timeframe_code, (timeframe, df) in enumerate(self.timeframe_data.items()):
+            timeframe_batches = self.find_level_batches_for_timeframe(timeframe, df)
+            series.extend((batch.levels, batch.touches, batch.weight, LEVEL_TYPES.index(batch.level_type), timeframe_code)
+                          for batch in timeframe_batches)
+            batches.extend(timeframe_batches)
+        
+        if not series or sum(len(prices) for prices, *_ in series) == 0:
+            return None
+        
+        # Parallel arrays over every timeframe level, ordered by price
+        level_prices = np.concatenate([prices for prices, *_ in series])
+        order = np.argsort(level_prices, kind='stable')
+        level_prices = level_prices[order]
+        touches = np.concatenate([level_touches for _, level_touches, *_ in series])[order]
+        weighted_touches = np.concatenate([level_touches * weight for _, level_touches, weight, *_ in series])[order]
+        type_names = np.array(LEVEL_TYPES)
+        type_codes = np.concatenate([np.full(len(prices), type_code) for prices, _, _, type_code, _ in series])[order]
+        timeframe_names = list(self.timeframe_data.keys())
+        timeframe_codes = np.concatenate([np.full(len(prices), code) for prices, *_, code in series])[order]
         
+        touch_times = None
+        if self.tracks_touch_times():
+            touch_times = (np.concatenate([batch.first_touches for batch in batches])[order],
+                           np.concatenate([batch.last_touches for batch in batches])[order],
+                           np.concatenate([batch.decayed_touches * batch.weight for batch in batches])[order]
+                           if self.recency_half_life_days else None)
+        
+        starts = self.similar_level_starts(level_prices)
+        groups = self.reduce_confluence_groups(level_prices, touches, weighted_touches, type_codes, len(type_names),
+                                               timeframe_codes, len(timeframe_names), starts, touch_times)
+        if self.role_reversals:
+            groups['role_flips'], groups['first_flip'], groups['last_flip'] = self.role_flips(batches, order, starts)
+        return groups, type_names, timeframe_names
+    
+    def role_flips(self, batches, order, starts):
+        """Role flips of each confluence group from the touches of its High and Low levels
+
+        A High touch meets the level as resistance (from below), a Low touch as
+        support (from above). Each touch is labelled with its confluence group
+        through its level's position in the price-ordered level arrays.
+        """
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        labels, times, roles = [], [], []
+        offset = 0
+        for batch in batches:
+            if batch.touch_times is not None and batch.level_type != 'Volume':
+                level_of_touch = np.repeat(np.arange(len(batch)), np.diff(np.append(batch.touch_starts, len(batch.touch_times))))
+                labels.append(np.searchsorted(starts, position[offset + level_of_touch], side='right') - 1)
+                times.append(batch.touch_times)
+                roles.append(np.full(len(batch.touch_times), 1 if batch.level_type == 'Resistance' else -1, dtype=np.int8))
+            offset += len(batch)
+        if not labels:
+            return role_reversals(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8), len(starts))
+        return role_reversals(np.concatenate(labels), np.concatenate(times), np.concatenate(roles), len(starts))
+    
+    def reduce_confluence_groups(self, level_prices, touches, weighted_touches, type_codes, type_count,
+                                 timeframe_codes, timeframe_count, starts, touch_times=None):
+        """Segment reductions per confluence group over price-ordered level arrays
+
+        touch_times, optional (first touch, last touch, decayed strength or None)
+        level arrays, adds the group's earliest and latest touch and summed strength.
+        """
+        if touch_times is not None:
+            first_touches, last_touches, decayed_strength = touch_times
+            groups = self.reduce_confluence_groups(level_prices, touches, weighted_touches, type_codes, type_count,
+                                                   timeframe_codes, timeframe_count, starts)
+            empty = len(starts) == 0
+            groups['first_touch'] = first_touches[:0] if empty else np.minimum.reduceat(first_touches, starts)
+            groups['last_touch'] = last_touches[:0] if empty else np.maximum.reduceat(last_touches, starts)
+            if decayed_strength is not None:
+                groups['decayed_strength'] = decayed_strength[:0] if empty else np.add.reduceat(decayed_strength, starts)
+            return groups
+        if len(starts) == 0:
+            return {
+                'touches': np.empty(0, dtype=np.int64),
+                'weighted_touches': np.empty(0, dtype=weighted_touches.dtype),
+                'levels': np.empty(0),
+                'type_counts': np.empty((0, type_count), dtype=np.int64),
+                'timeframe_present': np.empty((0, timeframe_count), dtype=bool),
+                'source_levels': np.empty(0, dtype=np.int64),
+                'lows': np.empty(0),
+                'highs': np.empty(0)
+            }
+        total_weighted_touches = np.add.reduceat(weighted_touches, starts)
+        ends = np.append(starts[1:], len(level_prices))
+        return {
+            'touches': np.add.reduceat(touches, starts),
+            'weighted_touches': total_weighted_touches,
+            'levels': np.add.reduceat(level_prices * weighted_touches, starts) / total_weighted_touches,
+            'type_counts': np.add.reduceat(np.eye(type_count, dtype=np.int64)[type_codes], starts, axis=0),
+            'timeframe_present': np.add.reduceat(np.eye(timeframe_count, dtype=np.int64)[timeframe_codes], starts, axis=0) > 0,
+            'source_levels': ends - starts,
+            'lows': level_prices[starts],
+            'highs': level_prices[ends - 1]
+        }
+    
+    def freeze_levels(self):
+        """LevelIndex of the current strong levels, kept until bars or tolerance change"""
+        confluence = self.confluence_groups()
+        if confluence is None:
+            self.level_index = LevelIndex([], [], [])
+            return self.level_index
+        groups, type_names, _ = confluence
+        strong = self.strong_level_indices(groups)
+        level_types = np.asarray(type_names)[groups['type_counts'][strong].argmax(axis=1)] if len(strong) else []
+        strength = groups['decayed_strength'] if self.rank_by == "recency" else groups['weighted_touches']
+        self.level_index = LevelIndex(groups['levels'][strong], level_types, strength[strong])
+        return self.level_index
+    
+    def nearest_levels(self, prices, level_types=('Support', 'Resistance')):
+        """Nearest support and resistance, signed distance and strength for an array of prices"""
+        index = self.level_index if self.level_index is not None else self.freeze_levels()
+        return index.nearest_levels(prices, level_types)
+    
+    def level_features(self, within_percentage=LEVEL_FEATURE_WITHIN_PERCENTAGE):
+        """Per-bar float32 features (LEVEL_FEATURE_COLUMNS) of every timeframe on its bar index
+
+        Distances are signed dollars from the bar's close to the nearest support
+        and resistance. Levels come from the whole loaded history; use
+        rolling_levels for features without look-ahead.
+        """
+        index = self.level_index if self.level_index is not None else self.freeze_levels()
+        features = {}
         for timeframe, df in self.timeframe_data.items():
-            tf_levels = self.find_levels_for_timeframe(timeframe, df)
-            all_levels.extend(tf_levels)
+            closes = df['Close'].to_numpy(dtype=float)
+            nearest = index.nearest_levels(closes)
+            matrix = np.column_stack([nearest[name] for name in LEVEL_FEATURE_COLUMNS[:-1]]
+                                     + [index.count_within(closes, within_percentage)]).astype(np.float32)
+            features[timeframe] = pd.DataFrame(matrix, index=df.index, columns=LEVEL_FEATURE_COLUMNS)
+        return features
+    
+    def export_level_features(self, file, within_percentage=LEVEL_FEATURE_WITHIN_PERCENTAGE):
+        """Write level_features to an .npz file (path or file object)
+
+        Holds a float32 matrix per timeframe, '<timeframe>_index' with its bar
+        times as int64 nanoseconds (row positions without a Date index) and
+        'columns' with the feature names.
+        """
+        arrays = {'columns': np.array(LEVEL_FEATURE_COLUMNS)}
+        for timeframe, features in self.level_features(within_percentage).items():
+            times = self.bar_times(features.index)
+            arrays[timeframe] = features.to_numpy()
+            arrays[f'{timeframe}_index'] = times if times is not None else np.arange(len(features), dtype=np.int64)
+        np.savez_compressed(file, **arrays)
+    
+    def strong_level_indices(self, groups, top=None):
+        """Confluence groups with at least min_touches, strongest first"""
+        strong = np.flatnonzero(groups['touches'] >= self.min_touches)
+        timeframe_counts = groups['timeframe_present'][strong].sum(axis=1)
+        strength = groups['decayed_strength'] if self.rank_by == "recency" else groups['weighted_touches']
+        return strong[strength_order(timeframe_counts, strength[strong], top)]
+    
+    def build_strong_levels(self, groups, type_names, timeframe_names, top_n=None, offset=0):
+        if offset < 0 or (top_n is not None and top_n < 0):
+            raise ValueError("top_n and offset must not be negative")
+        top = None if top_n is None else offset + top_n
+        strong = self.strong_level_indices(groups, top)[offset:]
+        return self.format_strong_levels(groups, type_names, timeframe_names, strong)
+    
+    def format_strong_levels(self, groups, type_names, timeframe_names, strong):
+        total_touches = groups['touches']
+        total_weighted_touches = groups['weighted_touches']
+        timeframe_present = groups['timeframe_present']
+        final_types = np.asarray(type_names)[groups['type_counts'][strong].argmax(axis=1)] if len(strong) else []
         
-        grouped_levels = self.group_similar_levels(all_levels)
+        # Timeframe name lists by presence pattern, one bit per timeframe
+        patterns = (timeframe_present.astype(np.int64) << np.arange(timeframe_present.shape[1])).sum(axis=1)
+        names_by_pattern = {}
+        for pattern, i in zip(*np.unique(patterns[strong], return_index=True)):
+            names_by_pattern[pattern] = [timeframe_names[j] for j in np.flatnonzero(timeframe_present[strong[i]])]
         
         strong_levels = []
-        for group in grouped_levels:
-            total_touches = sum(level['touches'] for level in group)
-            total_weighted_touches = sum(level['weighted_touches'] for level in group)
+        for final_level, final_type, touches, weighted_touches, pattern, source_levels in zip(
+                groups['levels'][strong].tolist(), np.asarray(final_types).tolist(),
+                total_touches[strong].tolist(), total_weighted_touches[strong].tolist(),
+                patterns[strong].tolist(), groups['source_levels'][strong].tolist()):
+            timeframes = list(names_by_pattern[pattern])
             
-            if total_touches >= self.min_touches:
-                weighted_sum = sum(level['level'] * level['weighted_touches'] for level in group)
-                final_level = weighted_sum / total_weighted_touches
-                
-                types = [level['type'] for level in group]
-                final_type = max(set(types), key=types.count)
-                
-                timeframes = list(set(level['timeframe'] for level in group))
-                
-                tolerance_info = {
-                    'tolerance_used': self.get_tolerance_for_price(final_level),
-                    'tolerance_mode': self.tolerance_mode,
-                    'tolerance_percentage': self.tolerance_percentage * 100
-                }
-                
-                strong_levels.append({
-                    'level': final_level,
-                    'type': final_type,
-                    'touches': total_touches,
-                    'weighted_touches': total_weighted_touches,
-                    'timeframes': timeframes,
-                    'timeframe_count': len(timeframes),
-                    'tolerance_info': tolerance_info,
-                    'source_levels': len(group)
-                })
-        
-        strong_levels.sort(key=lambda x: (x['timeframe_count'], x['weighted_touches']), reverse=True)
+            tolerance_info = {
+                'tolerance_used': self.get_tolerance_for_price(final_level),
+                'tolerance_mode': self.tolerance_mode,
+                'tolerance_percentage': self.tolerance_percentage * 100
+            }
+            
+            strong_levels.append({
+                'level': final_level,
+                'type': final_type,
+                'touches': touches,
+                'weighted_touches': weighted_touches,
+                'timeframes': timeframes,
+                'timeframe_count': len(timeframes),
+                'tolerance_info': tolerance_info,
+                'source_levels': source_levels
+            })
+        
+        if 'first_touch' in groups:
+            for level, first_touch, last_touch in zip(strong_levels, groups['first_touch'][strong].tolist(),
+                                                      groups['last_touch'][strong].tolist()):
+                level['first_touch'] = format_touch_time(first_touch)
+                level['last_touch'] = format_touch_time(last_touch)
+        if 'decayed_strength' in groups:
+            for level, decayed_strength in zip(strong_levels, groups['decayed_strength'][strong].tolist()):
+                level['decayed_strength'] = decayed_strength
+        if 'role_flips' in groups:
+            for level, flips, first_flip, last_flip in zip(strong_levels, groups['role_flips'][strong].tolist(),
+                                                           groups['first_flip'][strong].tolist(),
+                                                           groups['last_flip'][strong].tolist()):
+                level['role_flips'] = flips
+                level['first_flip'] = format_touch_time(first_flip)
+                level['last_flip'] = format_touch_time(last_flip)
         return strong_levels
     
+    def similar_level_starts(self, sorted_levels):
+        if self.tolerance_mode == "log_price":
+            if len(sorted_levels) and sorted_levels[0] <= 0:
+                raise ValueError("log_price tolerance mode requires positive prices")
+            gaps = np.diff(np.log(sorted_levels))
+            return np.concatenate(([0], np.flatnonzero(gaps > self.get_log_tolerance()) + 1)).astype(np.int64)
+        
+        gaps = np.diff(sorted_levels)
+        if self.tolerance_mode == "level_price":
+            tolerances = sorted_levels[1:] * self.tolerance_percentage
+        else:
+            tolerances = self.base_tolerance
+        return np.concatenate(([0], np.flatnonzero(gaps > tolerances) + 1)).astype(np.int64)
+    
     def group_similar_levels(self, all_levels):
         if not all_levels:
             return []
         
         sorted_levels = sorted(all_levels, key=lambda x: x['level'])
-        groups = []
-        current_group = [sorted_levels[0]]
-        
-        for level in sorted_levels[1:]:
-            tolerance = self.get_tolerance_for_price(level['level'])
-            
-            if any(abs(level['level'] - group_level['level']) <= tolerance 
-                   for group_level in current_group):
-                current_group.append(level)
-            else:
-                groups.append(current_group)
-                current_group = [level]
-        
-        groups.append(current_group)
-        return groups
+        starts = self.similar_level_starts(np.array([level['level'] for level in sorted_levels], dtype=float))
+        ends = np.append(starts[1:], len(sorted_levels))
+        return [sorted_levels[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
     
-    def analyze_missing_levels(self, price_range_start, price_range_end):
-        analysis = {
-            'range': f"${price_range_start}-${price_range_end}",
-            'current_tolerance': self.base_tolerance,
-            'prices_in_range': []
-        }
-        
-        for timeframe, df in self.timeframe_data.items():
-            for price_type in ['High', 'Low']:
-                prices_in_range = df[df[price_type].between(price_range_start, price_range_end)][price_type].tolist()
-                for price in prices_in_range:
-                    analysis['prices_in_range'].append({
-                        'timeframe': timeframe,
-                        'type': price_type,
-                        'price': price
-                    })
-        
-        if analysis['prices_in_range']:
-            prices = [p['price'] for p in analysis['prices_in_range']]
-            unique_prices = sorted(list(set(prices)))
-            
-            if len(unique_prices) > 1:
-                min_distance = min(abs(unique_prices[i+1] - unique_prices[i]) 
-                                 for i in range(len(unique_prices)-1))
-                mid_range_price = (price_range_start + price_range_end) / 2
-                suggested_tolerance_pct = (min_distance / mid_range_price) * 100
-                
-                analysis['suggested_tolerance_percentage'] = suggested_tolerance_pct
-                analysis['min_distance'] = min_distance
-                analysis['unique_price_count'] = len(unique_prices)
-        
-        return analysis
+    def get_range_index(self):
+        """PriceRangeIndex of the raw High/Low prices, built once per dataset"""
+        if self.range_index is None:
+            series = {}
+            for timeframe, df in self.timeframe_data.items():
+                for price_type in ['High', 'Low']:
+                    if timeframe in self.price_summaries:
+                        series[(timeframe, price_type)] = self.price_summaries[timeframe].price_counts(price_type)
+                    elif df is not None and price_type in df.columns:
+                        series[(timeframe, price_type)] = np.unique(finite_price_array(df[price_type]), return_counts=True)
+            self.range_index = PriceRangeIndex(series)
+        return self.range_index
+    
+    def analyze_missing_ranges(self, ranges, sample_size=RANGE_SAMPLE_SIZE):
+        """analyze_missing_levels for many (start, end) price ranges from one sorted index"""
+        if any(len(price_range) != 2 for price_range in ranges):
+            raise ValueError("Each price range needs a start and an end price")
+        ranges = [(float(start), float(end)) for start, end in ranges]
+        starts = [start for start, _ in ranges]
+        ends = [end for _, end in ranges]
+        analyses = []
+        for (start, end), result in zip(ranges, self.get_range_index().query(starts, ends, sample_size)):
+            analysis = {
+                'range': f"${start}-${end}",
+                'current_tolerance': self.base_tolerance,
+                **result
+            }
+            if 'min_distance' in result:
+                mid_range_price = (start + end) / 2
+                analysis['suggested_tolerance_percentage'] = (result['min_distance'] / mid_range_price) * 100
+            analyses.append(analysis)
+        return analyses
+    
+    def analyze_missing_levels(self, price_range_start, price_range_end, sample_size=RANGE_SAMPLE_SIZE):
+        """High/Low prices inside one range: counts, spacing and a sample of sample_size prices"""
+        return self.analyze_missing_ranges([(price_range_start, price_range_end)], sample_size)[0]
     
-    def get_detailed_results(self):
-        levels = self.combine_multi_timeframe_levels()
+    def get_detailed_results(self, tolerances=None, top_n=None, offset=0, significance=None):
+        """Strong levels with settings; significance (True or add_significance options) scores the returned levels"""
+        if tolerances is not None:
+            return self.get_results_for_tolerances(tolerances, top_n, offset)
+        
+        confluence = self.confluence_groups()
+        if confluence is None:
+            levels, total_count = [], 0
+        else:
+            levels = self.build_strong_levels(*confluence, top_n, offset)
+            total_count = self.count_strong_levels(confluence[0])
+        significance_info = None
+        if significance:
+            significance_info = self.add_significance(levels, **(significance if isinstance(significance, dict) else {}))
         level_prices = [f"{level['level']:.2f}" for level in levels]
+        next_offset = offset + len(levels)
         
         return {
             'levels_csv': ",".join(level_prices),
-            'total_count': len(levels),
+            'total_count': total_count,
             'detailed_levels': levels,
+            'offset': offset,
+            'next_offset': next_offset if next_offset < total_count else None,
             'timeframes_used': list(self.timeframe_data.keys()),
             'tolerance_info': {
                 'percentage': self.tolerance_percentage * 100,
@@ -319,8 +2521,35 @@ class MultiTimeframeSRFinder:
                 'tolerance_mode': self.tolerance_mode
             },
             'grouping_method': self.grouping_method,
-            'min_touches': self.min_touches
+            'min_touches': self.min_touches,
+            'rank_by': self.rank_by,
+            'role_reversals': self.role_reversals,
+            'significance': significance_info
         }
+    
+    def get_results_for_tolerances(self, tolerances, top_n=None, offset=0):
+        """Detailed results for several tolerance percentages from one sort per series"""
+        single_linkage = self.grouping_method == "conservative" and self.tolerance_mode in ("current_price", "log_price")
+        for timeframe, df in self.timeframe_data.items():
+            if df is None or df.empty:
+                continue
+            for column in ['High', 'Low']:
+                if column in df.columns:
+                    hierarchy = self.get_price_hierarchy(timeframe, column)
+                    if single_linkage and self.tolerance_mode == "log_price":
+                        hierarchy.log_hierarchy().build_merge_order()
+                    elif single_linkage:
+                        hierarchy.build_merge_order()
+        
+        saved_tolerance = (self.tolerance_percentage, self.base_tolerance)
+        results = {}
+        try:
+            for tolerance_percentage in tolerances:
+                self.set_tolerance_percentage(tolerance_percentage)
+                results[tolerance_percentage] = self.get_detailed_results(top_n=top_n, offset=offset)
+        finally:
+            self.tolerance_percentage, self.base_tolerance = saved_tolerance
+        return results
 
 # Simple, reliable HTML template with dropdowns
 HTML_TEMPLATE = '''
@@ -543,13 +2772,30 @@ HTML_TEMPLATE = '''
                         <option value="level_price" {{ 'selected' if last_settings.get('tolerance_mode') == 'level_price' else '' }}>
                             Level Price Based (NEW) - ⭐ RECOMMENDED for all stocks
                         </option>
+                        <option value="log_price" {{ 'selected' if last_settings.get('tolerance_mode') == 'log_price' else '' }}>
+                            Log Price Based (FAST) - Level-price tolerance as one sweep
+                        </option>
+                        <option value="atr" {{ 'selected' if last_settings.get('tolerance_mode') == 'atr' else '' }}>
+                            ATR Based - Multiple of each timeframe's Average True Range
+                        </option>
                     </select>
                     <div style="font-size: 12px; color: #666; margin-top: 5px;">
                         <strong>Current Price:</strong> 0.01% of $176 = $0.018 tolerance everywhere<br>
-                        <strong>Level Price:</strong> 0.01% of $155 = $0.016 tolerance at $155 level (adaptive)
+                        <strong>Level Price:</strong> 0.01% of $155 = $0.016 tolerance at $155 level (adaptive)<br>
+                        <strong>Log Price:</strong> same 0.01% measured from the nearest price below (fixed width in log space)<br>
+                        <strong>ATR:</strong> 0.5 × 14-bar ATR of each timeframe, ignores the percentage below
                     </div>
                 </div>
                 
+                <div class="form-group">
+                    <label for="atr_multiple">📏 ATR Multiple (ATR mode):</label>
+                    <select name="atr_multiple">
+                        <option value="0.25" {{ 'selected' if last_settings.get('atr_multiple') == '0.25' else '' }}>0.25 × ATR - Tight</option>
+                        <option value="0.5" {{ 'selected' if last_settings.get('atr_multiple', '0.5') == '0.5' else '' }}>0.5 × ATR (default)</option>
+                        <option value="1" {{ 'selected' if last_settings.get('atr_multiple') == '1' else '' }}>1 × ATR - Loose</option>
+                    </select>
+                </div>
+                
                 <div class="form-group">
                     <label for="grouping_method">📊 Grouping Method:</label>
                     <select name="grouping_method">
@@ -559,6 +2805,12 @@ HTML_TEMPLATE = '''
                         <option value="aggressive" {{ 'selected' if last_settings.get('grouping_method') == 'aggressive' else '' }}>
                             Aggressive - Groups similar levels more
                         </option>
+                        <option value="optimal" {{ 'selected' if last_settings.get('grouping_method') == 'optimal' else '' }}>
+                            Optimal - Fewest tight groups, minimum variance
+                        </option>
+                        <option value="density" {{ 'selected' if last_settings.get('grouping_method') == 'density' else '' }}>
+                            Density - Histogram peaks, no sorting (fastest on long histories)
+                        </option>
                     </select>
                 </div>
                 
@@ -585,6 +2837,82 @@ HTML_TEMPLATE = '''
                         <option value="6" {{ 'selected' if last_settings.get('min_touches') == '6' else '' }}>6 - Very Conservative</option>
                     </select>
                 </div>
+                
+                <div class="form-group">
+                    <label for="tick_size">🔢 Price Tick Size:</label>
+                    <select name="tick_size">
+                        <option value="" {{ 'selected' if not last_settings.get('tick_size') else '' }}>Off - Use raw prices</option>
+                        <option value="0.01" {{ 'selected' if last_settings.get('tick_size') == '0.01' else '' }}>0.01 - US equities (faster on large files)</option>
+                        <option value="0.0001" {{ 'selected' if last_settings.get('tick_size') == '0.0001' else '' }}>0.0001 - Sub-penny / FX</option>
+                    </select>
+                </div>
+                
+                <div class="form-group">
+                    <label for="pivot_window">📍 Swing Pivot Filter:</label>
+                    <select name="pivot_window">
+                        <option value="" {{ 'selected' if not last_settings.get('pivot_window') else '' }}>Off - Every bar high/low is a touch</option>
+                        <option value="3" {{ 'selected' if last_settings.get('pivot_window') == '3' else '' }}>±3 bars</option>
+                        <option value="5" {{ 'selected' if last_settings.get('pivot_window') == '5' else '' }}>±5 bars</option>
+                        <option value="10" {{ 'selected' if last_settings.get('pivot_window') == '10' else '' }}>±10 bars</option>
+                    </select>
+                </div>
+                
+                <div class="form-group">
+                    <label for="volume_profile">📊 Volume Profile Nodes:</label>
+                    <select name="volume_profile">
+                        <option value="" {{ 'selected' if last_settings.get('volume_profile') != 'on' else '' }}>Off - Price touches only</option>
+                        <option value="on" {{ 'selected' if last_settings.get('volume_profile') == 'on' else '' }}>On - Add high-volume nodes (needs a Volume column)</option>
+                    </select>
+                </div>
+                
+                <div class="form-group">
+                    <label>➕ Extra Level Sources:</label>
+                    <label style="font-weight: normal;"><input type="checkbox" name="level_sources" value="pivots" {{ 'checked' if 'pivots' in last_settings.get('level_sources', []) else '' }}> Floor pivots (P, R1/S1, R2/S2 of every bar)</label>
+                    <label style="font-weight: normal;"><input type="checkbox" name="level_sources" value="vwap" {{ 'checked' if 'vwap' in last_settings.get('level_sources', []) else '' }}> Anchored VWAPs from swing highs/lows (needs a Volume column)</label>
+                    <label style="font-weight: normal;"><input type="checkbox" name="level_sources" value="gaps" {{ 'checked' if 'gaps' in last_settings.get('level_sources', []) else '' }}> Unfilled gap edges</label>
+                </div>
+                
+                <div class="form-group">
+                    <label for="rank_by">⏱️ Rank Levels By:</label>
+                    <select name="rank_by">
+                        <option value="touches" {{ 'selected' if last_settings.get('rank_by') != 'recency' else '' }}>Weighted touches - All history counts the same</option>
+                        <option value="recency" {{ 'selected' if last_settings.get('rank_by') == 'recency' else '' }}>Recent strength - Touches decay with a 90-day half-life (needs a Date column)</option>
+                    </select>
+                </div>
+                
+                <div class="form-group">
+                    <label for="role_reversals">🔄 Role Reversals:</label>
+                    <select name="role_reversals">
+                        <option value="" {{ 'selected' if last_settings.get('role_reversals') != 'on' else '' }}>Off</option>
+                        <option value="on" {{ 'selected' if last_settings.get('role_reversals') == 'on' else '' }}>On - Count support/resistance flips per level (needs a Date column)</option>
+                    </select>
+                </div>
+                
+                <div class="form-group">
+                    <label for="significance">🎲 Significance:</label>
+                    <select name="significance">
+                        <option value="" {{ 'selected' if last_settings.get('significance') != 'on' else '' }}>Off</option>
+                        <option value="on" {{ 'selected' if last_settings.get('significance') == 'on' else '' }}>On - Bootstrap confidence and random-walk p-value per level (full uploads)</option>
+                    </select>
+                </div>
+                
+                <div class="form-group">
+                    <label for="max_levels">🏆 Levels Returned:</label>
+                    <select name="max_levels">
+                        <option value="" {{ 'selected' if not last_settings.get('max_levels') else '' }}>All levels</option>
+                        <option value="15" {{ 'selected' if last_settings.get('max_levels') == '15' else '' }}>Strongest 15</option>
+                        <option value="50" {{ 'selected' if last_settings.get('max_levels') == '50' else '' }}>Strongest 50</option>
+                        <option value="200" {{ 'selected' if last_settings.get('max_levels') == '200' else '' }}>Strongest 200</option>
+                    </select>
+                </div>
+                
+                <div class="form-group">
+                    <label for="upload_mode">📦 Upload Mode:</label>
+                    <select name="upload_mode">
+                        <option value="full" {{ 'selected' if last_settings.get('upload_mode') != 'stream' else '' }}>Full - Load whole file</option>
+                        <option value="stream" {{ 'selected' if last_settings.get('upload_mode') == 'stream' else '' }}>Streaming - High/Low summary for very large files</option>
+                    </select>
+                </div>
             </div>
 
             <div class="section">
@@ -632,6 +2960,9 @@ HTML_TEMPLATE = '''
                         <th>Touches</th>
                         <th>Timeframes</th>
                         <th>Strength</th>
+                        {% if result.rank_by == 'recency' %}<th>Recent Strength</th><th>Last Touch</th>{% endif %}
+                        {% if result.role_reversals %}<th>Role Flips</th><th>Last Flip</th>{% endif %}
+                        {% if result.significance %}<th>Confidence</th><th>p-value</th>{% endif %}
                         <th>Tolerance Used</th>
                     </tr>
                     {% for level in result.detailed_levels[:15] %}
@@ -641,6 +2972,9 @@ HTML_TEMPLATE = '''
                         <td>{{ level.touches }}</td>
                         <td>{{ level.timeframes | join(', ') }}</td>
                         <td>{{ level.weighted_touches }}</td>
+                        {% if result.rank_by == 'recency' %}<td>{{ "%.1f"|format(level.decayed_strength) }}</td><td>{{ (level.last_touch or 'N/A')[:10] }}</td>{% endif %}
+                        {% if result.role_reversals %}<td>{{ level.role_flips }}</td><td>{{ (level.last_flip or 'N/A')[:10] }}</td>{% endif %}
+                        {% if result.significance %}<td>{{ "%.0f%%"|format(100 * level.confidence) if level.confidence is not none else 'N/A' }}</td><td>{{ "%.3f"|format(level.p_value) if level.p_value is not none else 'N/A' }}</td>{% endif %}
                         <td>${{ "%.3f"|format(level.tolerance_info.tolerance_used) if level.tolerance_info else 'N/A' }}</td>
                     </tr>
                     {% endfor %}
@@ -648,6 +2982,9 @@ HTML_TEMPLATE = '''
                 {% if result.detailed_levels|length > 15 %}
                 <p><em>Showing top 15 levels...</em></p>
                 {% endif %}
+                {% if result.next_offset %}
+                <p><em>{{ result.detailed_levels|length }} of {{ result.total_count }} levels returned. More at <a href="/levels?offset={{ result.next_offset }}">/levels?offset={{ result.next_offset }}</a></em></p>
+                {% endif %}
             </div>
         </div>
         {% endif %}
@@ -655,7 +2992,7 @@ HTML_TEMPLATE = '''
         {% if range_analysis %}
         <div class="result">
             <h3>🔍 Missing Range Analysis: {{ range_analysis.range }}</h3>
-            <p><strong>Prices found in range:</strong> {{ range_analysis.prices_in_range | length }}</p>
+            <p><strong>Prices found in range:</strong> {{ range_analysis.price_count }}</p>
             <p><strong>Current tolerance:</strong> ${{ "%.3f"|format(range_analysis.current_tolerance) }}</p>
             
             {% if range_analysis.get('suggested_tolerance_percentage') %}
@@ -669,12 +3006,12 @@ HTML_TEMPLATE = '''
             
             {% if range_analysis.prices_in_range %}
             <div class="diagnostic-info">
-                <strong>Price occurrences in range (first 20):</strong><br>
-                {% for price_info in range_analysis.prices_in_range[:20] %}
+                <strong>Price occurrences in range (first {{ range_analysis.prices_in_range | length }}):</strong><br>
+                {% for price_info in range_analysis.prices_in_range %}
                 {{ price_info.timeframe }} {{ price_info.type }}: ${{ "%.2f"|format(price_info.price) }}<br>
                 {% endfor %}
-                {% if range_analysis.prices_in_range | length > 20 %}
-                ... and {{ range_analysis.prices_in_range | length - 20 }} more
+                {% if range_analysis.price_count > range_analysis.prices_in_range | length %}
+                ... and {{ range_analysis.price_count - range_analysis.prices_in_range | length }} more
                 {% endif %}
             </div>
             {% endif %}
@@ -699,6 +3036,7 @@ def save_dataframe_to_session(df, key):
         buffer = io.BytesIO()
         df.to_pickle(buffer)
         session[f'df_{key}'] = buffer.getvalue().hex()
+        session.pop(f'summary_{key}', None)
         return True
     except Exception as e:
         print(f"Error saving dataframe: {e}")
@@ -739,6 +3077,85 @@ def process_uploaded_file(file_obj):
     except Exception as e:
         raise ValueError(f"Error processing file: {str(e)}")
 
+def stream_csv_summary(file_obj, tick_size=None, chunksize=STREAM_CHUNK_ROWS):
+    """Fold an uploaded CSV into a PriceSummary, reading only High/Low/Close in chunks"""
+    try:
+        summary = PriceSummary(tick_size)
+        reader = pd.read_csv(file_obj, usecols=lambda name: name.lower().strip() in STREAM_COLUMNS, chunksize=chunksize)
+        for chunk in reader:
+            chunk.columns = [STREAM_COLUMNS[name.lower().strip()] for name in chunk.columns]
+            missing_cols = [col for col in ['High', 'Low', 'Close'] if col not in chunk.columns]
+            if missing_cols:
+                raise ValueError(f"Missing required columns: {missing_cols}")
+            summary.add(chunk)
+        if summary.recent is None:
+            raise ValueError("File has no rows")
+        return summary
+    except Exception as e:
+        raise ValueError(f"Error processing file: {str(e)}")
+
+def save_summary_to_session(summary, key):
+    """Save streamed price summary to session"""
+    try:
+        session[f'summary_{key}'] = summary.to_bytes().hex()
+        session.pop(f'df_{key}', None)
+        return True
+    except Exception as e:
+        print(f"Error saving price summary: {e}")
+        return False
+
+def load_summary_from_session(key):
+    """Load streamed price summary from session"""
+    try:
+        if f'summary_{key}' in session:
+            return PriceSummary.from_bytes(bytes.fromhex(session[f'summary_{key}']))
+    except Exception as e:
+        print(f"Error loading price summary: {e}")
+    return None
+
+def load_cached_timeframe(tf_key, timeframe_data, price_summaries):
+    """Add a timeframe cached in the session, as a price summary or a DataFrame"""
+    summary = load_summary_from_session(tf_key)
+    if summary is not None:
+        price_summaries[tf_key] = summary
+        timeframe_data[tf_key] = summary.recent_bars_frame()
+        return
+    df = load_dataframe_from_session(tf_key)
+    if df is not None:
+        timeframe_data[tf_key] = df
+
+def build_finder(settings, timeframe_data, price_summaries):
+    """Finder for the form settings"""
+    return MultiTimeframeSRFinder(
+        timeframe_data,
+        int(settings['min_touches']),
+        float(settings['tolerance_percentage']),
+        settings['grouping_method'],
+        settings['tolerance_mode'],
+        float(settings['tick_size']) if settings.get('tick_size') else None,
+        pivot_window=int(settings['pivot_window']) if settings.get('pivot_window') else None,
+        price_summaries=price_summaries,
+        volume_profile=settings.get('volume_profile') == 'on',
+        atr_multiple=float(settings.get('atr_multiple') or 0.5),
+        rank_by=settings.get('rank_by') or 'touches',
+        role_reversals=settings.get('role_reversals') == 'on',
+        level_sources=[source for source in settings.get('level_sources', []) if source in LEVEL_SOURCES]
+    )
+
+def cached_finder():
+    """Finder for the cached files and settings of the last analysis, or (None, error response)"""
+    last_settings = session.get('last_settings')
+    if not last_settings:
+        return None, (jsonify({'error': 'Run an analysis first'}), 400)
+    
+    timeframe_data = {}
+    price_summaries = {}
+    for tf_key in session.get('files_loaded', {}):
+        load_cached_timeframe(tf_key, timeframe_data, price_summaries)
+    if '1D' not in timeframe_data:
+        return None, (jsonify({'error': '1D timeframe file is required'}), 400)
+    return build_finder(last_settings, timeframe_data, price_summaries), None
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'GET':
@@ -805,18 +3222,40 @@ def index():
             'tolerance_percentage': request.form.get('tolerance_percentage', '0.01'),
             'grouping_method': request.form.get('grouping_method', 'conservative'),
             'tolerance_mode': request.form.get('tolerance_mode', 'current_price'),
+            'tick_size': request.form.get('tick_size', ''),
+            'pivot_window': request.form.get('pivot_window', ''),
+            'volume_profile': request.form.get('volume_profile', ''),
+            'atr_multiple': request.form.get('atr_multiple', '0.5'),
+            'rank_by': request.form.get('rank_by', 'touches'),
+            'role_reversals': request.form.get('role_reversals', ''),
+            'significance': request.form.get('significance', ''),
+            'level_sources': request.form.getlist('level_sources'),
+            'upload_mode': request.form.get('upload_mode', 'full'),
+            'max_levels': request.form.get('max_levels', ''),
             'analysis_range_start': request.form.get('analysis_range_start', '148'),
             'analysis_range_end': request.form.get('analysis_range_end', '170')
         }
         session['last_settings'] = settings
+        tick_size = float(settings['tick_size']) if settings['tick_size'] else None
         
         # Process files
         timeframe_data = {}
+        price_summaries = {}
         files_loaded = session.get('files_loaded', {})
         
         for tf_key, file_key in [('1D', 'file_1d'), ('4H', 'file_4h'), ('1H', 'file_1h')]:
+            # New file uploaded, streamed into a price summary
+            if file_key in request.files and request.files[file_key].filename != '' and settings['upload_mode'] == 'stream':
+                try:
+                    summary = stream_csv_summary(request.files[file_key].stream, tick_size)
+                    if save_summary_to_session(summary, tf_key):
+                        files_loaded[tf_key] = True
+                    price_summaries[tf_key] = summary
+                    timeframe_data[tf_key] = summary.recent_bars_frame()
+                except Exception as e:
+                    return render_template_string(HTML_TEMPLATE, error=f"Error processing {tf_key} file: {str(e)}")
             # New file uploaded
-            if file_key in request.files and request.files[file_key].filename != '':
+            elif file_key in request.files and request.files[file_key].filename != '':
                 try:
                     df = process_uploaded_file(request.files[file_key])
                     if save_dataframe_to_session(df, tf_key):
@@ -826,9 +3265,7 @@ def index():
                     return render_template_string(HTML_TEMPLATE, error=f"Error processing {tf_key} file: {str(e)}")
             # Use cached data
             elif tf_key in files_loaded:
-                df = load_dataframe_from_session(tf_key)
-                if df is not None:
-                    timeframe_data[tf_key] = df
+                load_cached_timeframe(tf_key, timeframe_data, price_summaries)
         
         session['files_loaded'] = files_loaded
         
@@ -838,13 +3275,7 @@ def index():
         
         # Handle range analysis only
         if action == 'analyze_range':
-            finder = MultiTimeframeSRFinder(
-                timeframe_data, 
-                settings['min_touches'], 
-                float(settings['tolerance_percentage']), 
-                settings['grouping_method'],
-                settings['tolerance_mode']
-            )
+            finder = build_finder(settings, timeframe_data, price_summaries)
             
             range_start = float(settings['analysis_range_start'])
             range_end = float(settings['analysis_range_end'])
@@ -854,15 +3285,11 @@ def index():
                                         files_loaded=files_loaded, last_settings=settings)
         
         # Full analysis
-        finder = MultiTimeframeSRFinder(
-            timeframe_data, 
-            settings['min_touches'], 
-            float(settings['tolerance_percentage']), 
-            settings['grouping_method'],
-            settings['tolerance_mode']
-        )
+        finder = build_finder(settings, timeframe_data, price_summaries)
         
-        results = finder.get_detailed_results()
+        max_levels = int(settings['max_levels']) if settings['max_levels'] else None
+        significance = {'workers': os.cpu_count()} if settings['significance'] == 'on' else None
+        results = finder.get_detailed_results(top_n=max_levels, significance=significance)
         
         # Range analysis
         range_analysis = None
@@ -884,6 +3311,61 @@ def index():
         return render_template_string(HTML_TEMPLATE, error=str(e), 
                                     files_loaded=files_loaded, last_settings=last_settings)
 
+@app.route('/levels')
+def levels_page():
+    """Next page of strong levels for the files and settings of the last analysis"""
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = max(1, min(int(request.args.get('limit', LEVEL_PAGE_SIZE)), MAX_LEVEL_PAGE))
+        finder, error = cached_finder()
+        if error:
+            return error
+        return jsonify(finder.get_detailed_results(top_n=limit, offset=offset))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/missing_levels', methods=['GET', 'POST'])
+def missing_levels():
+    """Missing-range analysis of many price ranges for the files and settings of the last analysis
+
+    POST JSON {"ranges": [[start, end], ...], "sample_size": 20}, or GET
+    ?ranges=148:170,180:190&sample_size=20.
+    """
+    try:
+        if request.method == 'POST':
+            payload = request.get_json(silent=True) or {}
+            ranges = payload.get('ranges', [])
+            sample_size = payload.get('sample_size', RANGE_SAMPLE_SIZE)
+        else:
+            ranges = [item.split(':') for item in request.args.get('ranges', '').split(',') if item]
+            sample_size = request.args.get('sample_size', RANGE_SAMPLE_SIZE)
+        sample_size = max(0, min(int(sample_size), MAX_RANGE_SAMPLE))
+        if not ranges:
+            return jsonify({'error': 'No price ranges given'}), 400
+        if len(ranges) > MAX_RANGES:
+            return jsonify({'error': f'At most {MAX_RANGES} ranges per request'}), 400
+        finder, error = cached_finder()
+        if error:
+            return error
+        return jsonify({'ranges': finder.analyze_missing_ranges(ranges, sample_size)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/features')
+def features_export():
+    """Per-bar level features of the last analysis as an .npz download"""
+    try:
+        within = float(request.args.get('within', LEVEL_FEATURE_WITHIN_PERCENTAGE))
+        finder, error = cached_finder()
+        if error:
+            return error
+        buffer = io.BytesIO()
+        finder.export_level_features(buffer, within)
+        buffer.seek(0)
+        return send_file(buffer, mimetype='application/octet-stream', as_attachment=True, download_name='level_features.npz')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/health')
 def health():
     return jsonify({'status': 'healthy', 'message': 'Multi-Timeframe S&R App is running'})
@@ -0,0 +1,106 @@
+"""Timing benchmark for the S&R grouping methods and walk engines
+
+Run with: python benchmark.py > bench_output.txt
+"""
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+import app
+from app import MultiTimeframeSRFinder
+
+SIZES = [10_000, 30_000, 100_000]
+ENGINE_SIZES = [10_000, 100_000, 1_000_000]
+ENGINE_TOLERANCES = [0.01, 0.5]
+METHODS = ['conservative', 'aggressive', 'optimal', 'density']
+TOLERANCES = [0.01, 0.05]
+REPEATS = 3
+
+
+def synthetic_bars(n, seed=0):
+    """Random-walk 1H bars rounded to cents"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    high = close * (1 + np.abs(rng.normal(0, 0.002, n)))
+    low = close * (1 - np.abs(rng.normal(0, 0.002, n)))
+    return pd.DataFrame({'Open': close, 'High': high.round(2), 'Low': low.round(2), 'Close': close},
+                        index=pd.date_range('2015-01-01', periods=n, freq='h'))
+
+
+def time_grouping(df, method, tolerance, tolerance_mode, tick_size=None):
+    best = float('inf')
+    level_count = 0
+    for _ in range(REPEATS):
+        with contextlib.redirect_stdout(io.StringIO()):
+            finder = MultiTimeframeSRFinder({'1H': df}, 2, tolerance, method, tolerance_mode, tick_size)
+            start = time.perf_counter()
+            levels = finder.find_levels_for_timeframe('1H', finder.timeframe_data['1H'])
+            best = min(best, time.perf_counter() - start)
+        level_count = len(levels)
+    return best, level_count
+
+
+def time_call(function):
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def walk_engines(sorted_prices, method, tolerance_percentage):
+    """Level-price group starts three ways: the plain walk over every price,
+    vectorized splits plus the Python walk, and vectorized splits plus the
+    Numba walk (None when Numba is not installed)"""
+    values = sorted_prices.tolist()
+    ones = [1] * len(values)
+    if method == 'conservative':
+        pure = lambda: app._walk_conservative_level_price(values, ones, tolerance_percentage)
+        engine = lambda: app.conservative_group_starts(sorted_prices, 0.0, tolerance_percentage)
+    else:
+        pure = lambda: app._walk_aggressive(values, ones, 0.0, tolerance_percentage)
+        engine = lambda: app.aggressive_group_starts(sorted_prices, 0.0, tolerance_percentage)
+    
+    jit_walks = app.SEGMENT_WALKS
+    app.SEGMENT_WALKS = {}
+    try:
+        numpy_seconds = time_call(engine)
+    finally:
+        app.SEGMENT_WALKS = jit_walks
+    jit_seconds = time_call(engine) if jit_walks else None
+    return time_call(pure), numpy_seconds, jit_seconds
+
+
+def engine_table():
+    print(f"\nWalk engines, level_price mode (JIT: {'numba' if app.SEGMENT_WALKS else 'not installed'})")
+    print(f"{'prices':>9} {'method':>13} {'tol %':>6} {'pure python':>12} {'numpy':>10} {'jit':>10}")
+    for size in ENGINE_SIZES:
+        sorted_prices = np.sort(synthetic_bars(size)['High'].to_numpy() * (1 + np.random.default_rng(1).normal(0, 1e-4, size)))
+        for method in ['conservative', 'aggressive']:
+            for tolerance in ENGINE_TOLERANCES:
+                pure, numpy_seconds, jit_seconds = walk_engines(sorted_prices, method, tolerance / 100)
+                jit_cell = f"{jit_seconds * 1000:7.1f} ms" if jit_seconds is not None else f"{'-':>10}"
+                print(f"{size:>9} {method:>13} {tolerance:>6} {pure * 1000:9.1f} ms {numpy_seconds * 1000:7.1f} ms {jit_cell}")
+
+
+def main():
+    print(f"{'bars':>8} {'mode':>13} {'tol %':>6} {'tick':>5} " + " ".join(f"{m:>22}" for m in METHODS))
+    for size in SIZES:
+        df = synthetic_bars(size)
+        for tolerance_mode in ['current_price', 'level_price']:
+            for tolerance in TOLERANCES:
+                for tick_size in [None, 0.01]:
+                    cells = []
+                    for method in METHODS:
+                        seconds, level_count = time_grouping(df, method, tolerance, tolerance_mode, tick_size)
+                        cells.append(f"{seconds * 1000:9.1f} ms {level_count:6d} lv")
+                    print(f"{size:>8} {tolerance_mode:>13} {tolerance:>6} {str(tick_size or '-'):>5} " + " ".join(f"{c:>22}" for c in cells))
+    engine_table()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+"""Shared bar data for the tests"""
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def random_walk_bars(n, seed, decimals=2, freq='h', start='2020-01-01'):
+    """OHLC bars of a geometric random walk, High/Low rounded to decimals, 1% of Highs missing"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    high = close * (1 + np.abs(rng.normal(0, 0.005, n)))
+    low = close * (1 - np.abs(rng.normal(0, 0.005, n)))
+    df = pd.DataFrame({'Open': close, 'High': high.round(decimals), 'Low': low.round(decimals), 'Close': close},
+                      index=pd.date_range(start, periods=n, freq=freq))
+    df.loc[df.sample(frac=0.01, random_state=seed).index, 'High'] = np.nan
+    return df
+
+
+@pytest.fixture
+def make_bars():
+    return random_walk_bars
@@ -0,0 +1,234 @@
+"""The array grouping engines against the original Python loops they replaced"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+from app import MultiTimeframeSRFinder, PartialLevels, PriceHierarchy
+
+
+def make_finder(make_bars, grouping_method, tolerance_mode, tolerance_percentage, seed=0, decimals=2):
+    data = {'1D': make_bars(300, seed), '4H': make_bars(900, seed + 100), '1H': make_bars(2000, seed + 200, decimals)}
+    return MultiTimeframeSRFinder(data, 2, tolerance_percentage, grouping_method, tolerance_mode)
+
+
+def reference_conservative_groups(finder, prices):
+    """Original loop: join the group when the nearest member is within tolerance"""
+    sorted_prices = sorted(p for p in prices if not pd.isna(p))
+    groups = [[sorted_prices[0]]]
+    for price in sorted_prices[1:]:
+        current_group = groups[-1]
+        if finder.tolerance_mode == "level_price":
+            tolerance = finder.get_tolerance_for_price(sum(current_group) / len(current_group))
+        else:
+            tolerance = finder.base_tolerance
+        if min(abs(price - p) for p in current_group) <= tolerance:
+            current_group.append(price)
+        else:
+            groups.append([price])
+    return groups
+
+
+def reference_aggressive_groups(finder, prices):
+    """Original loop: join the group when the price is within tolerance of its running mean"""
+    sorted_prices = sorted(p for p in prices if not pd.isna(p))
+    groups = [[sorted_prices[0]]]
+    for price in sorted_prices[1:]:
+        current_group = groups[-1]
+        group_center = sum(current_group) / len(current_group)
+        if finder.tolerance_mode == "level_price":
+            tolerance = finder.get_tolerance_for_price(group_center)
+        else:
+            tolerance = finder.base_tolerance
+        if abs(price - group_center) <= tolerance:
+            current_group.append(price)
+        else:
+            groups.append([price])
+    return groups
+
+
+def reference_levels(groups):
+    """Original level of each group: median from three touches, mean below"""
+    return [(float(np.median(group)) if len(group) >= 3 else sum(group) / len(group), len(group), group)
+            for group in groups]
+
+
+def reference_level_dicts(finder, groups, level_type, timeframe, weight):
+    """Original convert_groups_to_levels, every detail built up front"""
+    levels = []
+    for group in groups:
+        level_price = float(np.median(group)) if len(group) >= 3 else sum(group) / len(group)
+        levels.append({
+            'level': level_price,
+            'type': level_type,
+            'touches': len(group),
+            'timeframe': timeframe,
+            'weight': weight,
+            'weighted_touches': len(group) * weight,
+            'original_prices': group,
+            'price_range': f"${min(group):.2f}-${max(group):.2f}" if len(group) > 1 else f"${group[0]:.2f}",
+            'tolerance_used': finder.get_tolerance_for_price(level_price),
+            'price_spread': max(group) - min(group) if len(group) > 1 else 0
+        })
+    return levels
+
+
+def reference_confluence(finder):
+    """Original confluence step over the finder's per-timeframe levels, strongest first"""
+    all_levels = [level for timeframe, df in finder.timeframe_data.items()
+                  for level in finder.find_levels_for_timeframe(timeframe, df)]
+    sorted_levels = sorted(all_levels, key=lambda x: x['level'])
+    groups = [[sorted_levels[0]]]
+    for level in sorted_levels[1:]:
+        tolerance = finder.get_tolerance_for_price(level['level'])
+        if any(abs(level['level'] - g['level']) <= tolerance for g in groups[-1]):
+            groups[-1].append(level)
+        else:
+            groups.append([level])
+    
+    strong_levels = []
+    for group in groups:
+        touches = sum(level['touches'] for level in group)
+        weighted_touches = sum(level['weighted_touches'] for level in group)
+        if touches >= finder.min_touches:
+            types = [level['type'] for level in group]
+            timeframes = set(level['timeframe'] for level in group)
+            strong_levels.append({
+                'level': sum(level['level'] * level['weighted_touches'] for level in group) / weighted_touches,
+                'types': {t for t in types if types.count(t) == max(map(types.count, types))},
+                'touches': touches,
+                'weighted_touches': weighted_touches,
+                'timeframes': timeframes,
+                'source_levels': len(group)
+            })
+    strong_levels.sort(key=lambda x: (len(x['timeframes']), x['weighted_touches']), reverse=True)
+    return strong_levels
+
+
+def assert_levels_match(levels, expected):
+    assert len(levels) == len(expected)
+    for level, (price, touches, group) in zip(levels, expected):
+        assert level['touches'] == touches
+        assert level['original_prices'] == group
+        assert level['level'] == pytest.approx(price, rel=1e-12)
+
+
+@pytest.mark.parametrize('tolerance_mode', ['current_price', 'level_price'])
+@pytest.mark.parametrize('tolerance_percentage', [0.005, 0.05, 0.5])
+@pytest.mark.parametrize('decimals', [1, 2, 4])
+def test_conservative_matches_original_loop(make_bars, tolerance_mode, tolerance_percentage, decimals):
+    finder = make_finder(make_bars, 'conservative', tolerance_mode, tolerance_percentage, decimals=decimals)
+    for column, level_type in [('High', 'Resistance'), ('Low', 'Support')]:
+        prices = finder.timeframe_data['1H'][column]
+        levels = finder.group_prices_conservative(prices, level_type, '1H', 1)
+        assert_levels_match(levels, reference_levels(reference_conservative_groups(finder, prices.tolist())))
+
+
+@pytest.mark.parametrize('tolerance_mode', ['current_price', 'level_price'])
+@pytest.mark.parametrize('tolerance_percentage', [0.005, 0.05, 0.5])
+@pytest.mark.parametrize('decimals', [1, 2, 4])
+def test_aggressive_matches_original_loop(make_bars, tolerance_mode, tolerance_percentage, decimals):
+    finder = make_finder(make_bars, 'aggressive', tolerance_mode, tolerance_percentage, decimals=decimals)
+    for column, level_type in [('High', 'Resistance'), ('Low', 'Support')]:
+        prices = finder.timeframe_data['1H'][column]
+        levels = finder.group_prices_aggressive(prices, level_type, '1H', 1)
+        assert_levels_match(levels, reference_levels(reference_aggressive_groups(finder, prices.tolist())))
+
+
+@pytest.mark.parametrize('grouping_method', ['conservative', 'aggressive'])
+@pytest.mark.parametrize('tolerance_mode', ['current_price', 'level_price'])
+@pytest.mark.parametrize('tolerance_percentage', [0.005, 0.05, 0.5, 3.0])
+def test_confluence_matches_original_loop(make_bars, grouping_method, tolerance_mode, tolerance_percentage):
+    finder = make_finder(make_bars, grouping_method, tolerance_mode, tolerance_percentage, seed=1)
+    levels = finder.combine_multi_timeframe_levels()
+    expected = reference_confluence(finder)
+    assert len(levels) == len(expected)
+    for level, reference in zip(levels, expected):
+        assert (level['touches'], level['weighted_touches'], level['source_levels']) == \
+            (reference['touches'], reference['weighted_touches'], reference['source_levels'])
+        assert set(level['timeframes']) == reference['timeframes']
+        assert level['timeframe_count'] == len(reference['timeframes'])
+        # Ties between types were broken by set order in the original
+        assert level['type'] in reference['types']
+        assert level['level'] == pytest.approx(reference['level'], rel=1e-12)
+
+
+@pytest.mark.parametrize('tolerance_mode', ['current_price', 'level_price'])
+def test_level_batch_details_match_original_dicts(make_bars, tolerance_mode):
+    finder = make_finder(make_bars, 'conservative', tolerance_mode, 0.05)
+    prices = finder.timeframe_data['4H']['Low']
+    batch = finder.segment_level_batch(finder.get_price_hierarchy('4H', 'Low'), 'Support', '4H', 2)
+    expected = reference_level_dicts(finder, reference_conservative_groups(finder, prices.tolist()), 'Support', '4H', 2)
+    levels = batch.to_dicts()
+    assert len(levels) == len(batch) == len(expected)
+    for level, record, reference in zip(levels, batch, expected):
+        assert level.keys() == reference.keys()
+        for key in ['type', 'touches', 'timeframe', 'weight', 'weighted_touches', 'original_prices', 'price_range']:
+            assert level[key] == reference[key]
+        for key in ['level', 'tolerance_used', 'price_spread']:
+            assert level[key] == pytest.approx(reference[key], rel=1e-12)
+        # Lazy record details are the same values
+        assert (record.level, record.type, record.touches, record.weighted_touches) == \
+            (level['level'], level['type'], level['touches'], level['weighted_touches'])
+        assert (record.original_prices, record.price_range, record.price_spread) == \
+            (level['original_prices'], level['price_range'], level['price_spread'])
+
+
+def test_level_pages_slice_the_full_list(make_bars):
+    finder = make_finder(make_bars, 'conservative', 'level_price', 0.05)
+    levels = finder.combine_multi_timeframe_levels()
+    for top_n, offset in [(10, 0), (10, 25), (1, len(levels) - 1), (5, len(levels) + 5), (0, 3)]:
+        assert finder.combine_multi_timeframe_levels(top_n, offset) == levels[offset:offset + top_n]
+    for top_n, offset in [(-1, 0), (10, -1)]:
+        with pytest.raises(ValueError):
+            finder.combine_multi_timeframe_levels(top_n, offset)
+
+
+def shard_cuts(sorted_prices, rng):
+    """Random cuts plus cuts inside runs of duplicate prices, where the series has any"""
+    inside_runs = np.flatnonzero(sorted_prices[1:] == sorted_prices[:-1]) + 1
+    cuts = np.concatenate((rng.integers(1, len(sorted_prices), 6), rng.choice(inside_runs, min(4, len(inside_runs))), [1, len(sorted_prices) - 1]))
+    return np.unique(cuts)
+
+
+@pytest.mark.parametrize('grouping_method', ['conservative', 'aggressive'])
+@pytest.mark.parametrize('tolerance_mode', ['current_price', 'level_price', 'log_price', 'atr'])
+@pytest.mark.parametrize('tick_size', [None, 0.1])
+def test_merged_shards_match_whole_series(make_bars, grouping_method, tolerance_mode, tick_size):
+    rng = np.random.default_rng(5)
+    data = {'1D': make_bars(300, 0), '1H': make_bars(3000, 1, 1)}
+    for tolerance_percentage in [0.05, 0.5]:
+        finder = MultiTimeframeSRFinder(data, 2, tolerance_percentage, grouping_method, tolerance_mode, tick_size)
+        for column in ['High', 'Low']:
+            hierarchy = finder.get_price_hierarchy('1H', column)
+            prices, counts = hierarchy.sorted_prices, hierarchy.counts
+            bounds = [0] + shard_cuts(prices, rng).tolist() + [len(prices)]
+            merged = PartialLevels(prices[:0], None if counts is None else counts[:0], np.empty(0, dtype=np.int64))
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                shard = PriceHierarchy(prices[start:end], presorted=True, counts=None if counts is None else counts[start:end])
+                merged = merged.merge(PartialLevels(shard.sorted_prices, shard.counts, finder.group_starts(shard)),
+                                      finder.group_starts)
+            assert merged.starts.tolist() == finder.group_starts(hierarchy).tolist()
+
+
+def test_process_pool_shards_match_in_process(make_bars, monkeypatch):
+    monkeypatch.setattr(app, 'SHARD_MIN_PRICES', 100)
+    data = {'1D': make_bars(300, 0), '4H': make_bars(900, 1, 1), '1H': make_bars(3000, 2, 1)}
+    for grouping_method in ['conservative', 'aggressive', 'optimal']:
+        levels = MultiTimeframeSRFinder(data, 2, 0.05, grouping_method, 'level_price').combine_multi_timeframe_levels()
+        pooled = MultiTimeframeSRFinder(data, 2, 0.05, grouping_method, 'level_price', workers=2)
+        assert pooled.combine_multi_timeframe_levels() == levels
+
+
+@pytest.mark.parametrize('grouping_method', ['conservative', 'aggressive', 'optimal'])
+@pytest.mark.parametrize('tolerance_mode', ['current_price', 'level_price', 'log_price'])
+def test_tolerance_sweep_matches_fresh_finders(make_bars, grouping_method, tolerance_mode):
+    tolerances = [0.005, 0.05, 0.5, 3.0]
+    finder = make_finder(make_bars, grouping_method, tolerance_mode, 0.05, seed=2)
+    swept = finder.get_detailed_results(tolerances=tolerances, top_n=50)
+    assert list(swept) == tolerances
+    for tolerance_percentage in tolerances:
+        fresh = make_finder(make_bars, grouping_method, tolerance_mode, tolerance_percentage, seed=2)
+        assert swept[tolerance_percentage] == fresh.get_detailed_results(top_n=50)
+    # The finder's own tolerance is restored
+    assert finder.get_detailed_results(top_n=50) == make_finder(make_bars, grouping_method, tolerance_mode, 0.05, seed=2).get_detailed_results(top_n=50)
@@ -0,0 +1,96 @@
+"""Incremental append_bars/remove_bars against a full recomputation on the same bars"""
+import pytest
+
+from app import MultiTimeframeSRFinder, PriceSummary
+
+
+def full_data(make_bars, seed=0):
+    return {'1D': make_bars(200, seed, freq='D'), '4H': make_bars(1200, seed + 100, freq='4h'),
+            '1H': make_bars(4800, seed + 200)}
+
+
+def recomputed(finder, settings):
+    """Levels of a fresh finder over the bars the incremental finder holds now"""
+    fresh = MultiTimeframeSRFinder({timeframe: df.copy() for timeframe, df in finder.timeframe_data.items()}, **settings)
+    return fresh.combine_multi_timeframe_levels()
+
+
+def assert_same_levels(levels, expected):
+    """Same levels in the same order; prices may differ in the last bits from the summation order"""
+    assert len(levels) == len(expected)
+    for level, reference in zip(levels, expected):
+        assert level['level'] == pytest.approx(reference['level'], rel=1e-12)
+        assert level['tolerance_info']['tolerance_used'] == pytest.approx(reference['tolerance_info']['tolerance_used'], rel=1e-12)
+        for key in ['type', 'touches', 'weighted_touches', 'timeframes', 'timeframe_count', 'source_levels']:
+            assert level[key] == reference[key]
+
+
+SETTINGS = [
+    dict(grouping_method=method, tolerance_mode=mode, tick_size=tick_size, tolerance_percentage=tolerance)
+    for method in ['conservative', 'aggressive', 'optimal']
+    for mode in ['current_price', 'level_price', 'log_price']
+    for tick_size in [None, 0.01]
+    for tolerance in [0.05, 0.5]
+]
+
+
+@pytest.mark.parametrize('settings', SETTINGS, ids=lambda s: '-'.join(str(v) for v in s.values()))
+def test_append_and_remove_match_full_recompute(make_bars, settings):
+    full = full_data(make_bars)
+    start = {timeframe: df.iloc[:len(df) * 4 // 5] for timeframe, df in full.items()}
+    finder = MultiTimeframeSRFinder({timeframe: df.copy() for timeframe, df in start.items()}, incremental=True, **settings)
+    finder.combine_multi_timeframe_levels()
+
+    # Other timeframes in two chunks, then the primary one
+    for timeframe in ['1H', '4H', '1H', '4H', '1D']:
+        have = len(finder.timeframe_data[timeframe])
+        step = len(full[timeframe]) - have if timeframe == '1D' else max(1, (len(full[timeframe]) - len(start[timeframe])) // 2)
+        finder.append_bars(timeframe, full[timeframe].iloc[have:have + step])
+        assert_same_levels(finder.combine_multi_timeframe_levels(), recomputed(finder, settings))
+
+    for timeframe, count in [('1H', 500), ('4H', 100), ('1D', 20)]:
+        finder.remove_bars(timeframe, count)
+        assert_same_levels(finder.combine_multi_timeframe_levels(), recomputed(finder, settings))
+
+    assert all(len(finder.timeframe_data[timeframe]) == len(full[timeframe]) - count
+               for timeframe, count in [('1H', 500), ('4H', 100), ('1D', 20)])
+    # Relative tolerances do not move with the close, so the groups were updated in place
+    if settings['tolerance_mode'] != 'current_price':
+        assert finder.incremental_state is not None
+
+
+def test_appended_timeframe_matches_full_recompute(make_bars):
+    full = full_data(make_bars, 1)
+    settings = dict(grouping_method='conservative', tolerance_mode='level_price')
+    finder = MultiTimeframeSRFinder({'1D': full['1D'].copy(), '4H': full['4H'].copy()}, incremental=True, **settings)
+    finder.combine_multi_timeframe_levels()
+    finder.append_bars('1H', full['1H'])
+    assert_same_levels(finder.combine_multi_timeframe_levels(), recomputed(finder, settings))
+
+
+@pytest.mark.parametrize('settings', [dict(grouping_method=method, tolerance_mode=mode)
+                                      for method in ['conservative', 'aggressive']
+                                      for mode in ['current_price', 'level_price', 'log_price']],
+                         ids=lambda s: '-'.join(s.values()))
+def test_rolling_levels_match_fresh_slices(make_bars, settings):
+    full = full_data(make_bars, 2)
+    finder = MultiTimeframeSRFinder(full, **settings)
+    dates = full['1D'].index
+    steps = 0
+    for end, (date, levels) in zip(range(60, len(dates) + 1, 7), finder.rolling_levels(60, step=7)):
+        assert date == dates[end - 1]
+        first, last = dates[end - 60], dates[end - 1]
+        window = {timeframe: df[(df.index >= first) & (df.index <= last)] for timeframe, df in full.items()}
+        fresh = MultiTimeframeSRFinder({timeframe: df.copy() for timeframe, df in window.items()}, **settings)
+        assert_same_levels(levels, fresh.combine_multi_timeframe_levels())
+        steps += 1
+    assert steps == len(range(60, len(dates) + 1, 7))
+
+
+def test_streamed_timeframe_rejects_remove(make_bars):
+    full = full_data(make_bars)
+    summary = PriceSummary()
+    summary.add(full['1H'])
+    finder = MultiTimeframeSRFinder({'1D': full['1D'], '1H': summary.recent_bars_frame()}, price_summaries={'1H': summary})
+    with pytest.raises(ValueError):
+        finder.remove_bars('1H', 10)
@@ -0,0 +1,54 @@
+"""Indexed missing-range analysis against a scan of the raw High/Low columns"""
+import numpy as np
+import pytest
+
+from app import MultiTimeframeSRFinder
+
+
+def scanned(finder, start, end):
+    """Prices in [start, end] found by scanning every High/Low column, as the original analysis did"""
+    prices = [price for df in finder.timeframe_data.values() for column in ['High', 'Low']
+              for price in df[column][df[column].between(start, end)].tolist()]
+    unique_prices = sorted(set(prices))
+    return len(prices), unique_prices
+
+
+def assert_matches_scan(finder, ranges):
+    for (start, end), analysis in zip(ranges, finder.analyze_missing_ranges(ranges, sample_size=5)):
+        count, unique_prices = scanned(finder, start, end)
+        assert analysis['price_count'] == count
+        assert len(analysis['prices_in_range']) == min(count, 5)
+        if len(unique_prices) > 1:
+            assert analysis['unique_price_count'] == len(unique_prices)
+            assert analysis['min_distance'] == min(np.diff(unique_prices))
+        else:
+            assert 'min_distance' not in analysis
+
+
+RANGES = [(95, 105), (99.5, 100.5), (100, 100), (80, 200), (300, 400), (105, 95)]
+
+
+def test_ranges_match_column_scan(make_bars):
+    finder = MultiTimeframeSRFinder({'1D': make_bars(300, 0), '4H': make_bars(900, 1), '1H': make_bars(2000, 2, 3)})
+    assert_matches_scan(finder, RANGES)
+
+
+def test_header_only_timeframe(make_bars):
+    empty = make_bars(10, 1).iloc[:0]
+    finder = MultiTimeframeSRFinder({'1D': make_bars(300, 0), '4H': empty})
+    assert_matches_scan(finder, RANGES)
+    assert finder.analyze_missing_levels(95, 105)['counts']['4H'] == {'High': 0, 'Low': 0}
+
+
+def test_blank_low_column(make_bars):
+    blank = make_bars(2000, 2)
+    blank['Low'] = np.nan
+    finder = MultiTimeframeSRFinder({'1D': make_bars(300, 0), '1H': blank})
+    assert_matches_scan(finder, RANGES)
+    assert finder.analyze_missing_levels(95, 105)['counts']['1H']['Low'] == 0
+
+
+def test_malformed_range_is_rejected(make_bars):
+    finder = MultiTimeframeSRFinder({'1D': make_bars(300, 0)})
+    with pytest.raises(ValueError):
+        finder.analyze_missing_ranges([(95,)])
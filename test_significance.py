@@ -0,0 +1,49 @@
+"""Bootstrap confidence and random-walk p_value of the strong levels"""
+import numpy as np
+import pytest
+
+from app import MultiTimeframeSRFinder
+
+
+def significance(finder, **kwargs):
+    levels = finder.combine_multi_timeframe_levels()[:20]
+    info = finder.add_significance(levels, bootstrap_samples=40, null_samples=40, time_budget=60, seed=7, **kwargs)
+    return levels, info
+
+
+def assert_valid(levels, info):
+    assert info['bootstrap_samples'] == 40 and info['null_samples'] == 40
+    for level in levels:
+        assert 0 <= level['confidence'] <= 1
+        assert 0 < level['p_value'] <= 1
+
+
+def test_values_are_shares_and_seeded(make_bars):
+    data = {'1D': make_bars(300, 0), '4H': make_bars(900, 1), '1H': make_bars(2000, 2)}
+    levels, info = significance(MultiTimeframeSRFinder(data))
+    assert_valid(levels, info)
+    again, _ = significance(MultiTimeframeSRFinder({timeframe: df.copy() for timeframe, df in data.items()}))
+    assert [(level['confidence'], level['p_value']) for level in levels] == \
+        [(level['confidence'], level['p_value']) for level in again]
+
+
+def test_capped_level_is_confident_and_significant(make_bars):
+    bars = make_bars(2000, 3)
+    ceiling = bars['Low'].quantile(0.9)
+    bars['High'] = np.minimum(bars['High'], ceiling)
+    bars['Low'] = np.minimum(bars['Low'], ceiling)
+    bars['Close'] = np.minimum(bars['Close'], ceiling)
+    finder = MultiTimeframeSRFinder({'1D': bars}, tolerance_percentage=0.05)
+    levels, info = significance(finder)
+    assert_valid(levels, info)
+    capped = min(levels, key=lambda level: abs(level['level'] - ceiling))
+    assert capped['level'] == pytest.approx(ceiling)
+    assert capped['confidence'] == 1
+    assert capped['p_value'] == min(level['p_value'] for level in levels) < 0.05
+
+
+def test_blank_low_column(make_bars):
+    blank = make_bars(2000, 2)
+    blank['Low'] = np.nan
+    levels, info = significance(MultiTimeframeSRFinder({'1D': make_bars(300, 0), '1H': blank}))
+    assert_valid(levels, info)
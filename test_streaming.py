@@ -0,0 +1,52 @@
+"""Streamed price summaries against finders over the whole uploaded DataFrame"""
+import io
+
+import numpy as np
+import pytest
+
+from app import MultiTimeframeSRFinder, PriceSummary, process_uploaded_file, stream_csv_summary
+
+
+def csv_bytes(df):
+    return df.rename_axis('Date').to_csv().encode('utf-8')
+
+
+def streamed_finder(files, settings, round_trip=False):
+    timeframe_data, price_summaries = {}, {}
+    for timeframe, content in files.items():
+        summary = stream_csv_summary(io.BytesIO(content), settings.get('tick_size'), chunksize=700)
+        if round_trip:
+            summary = PriceSummary.from_bytes(summary.to_bytes())
+        price_summaries[timeframe] = summary
+        timeframe_data[timeframe] = summary.recent_bars_frame()
+    return MultiTimeframeSRFinder(timeframe_data, price_summaries=price_summaries, **settings)
+
+
+SETTINGS = [
+    dict(grouping_method=method, tolerance_mode=mode, tick_size=tick_size, tolerance_percentage=0.05)
+    for method in ['conservative', 'aggressive', 'optimal']
+    for mode in ['current_price', 'level_price']
+    for tick_size in [None, 0.01]
+]
+
+
+@pytest.mark.parametrize('settings', SETTINGS, ids=lambda s: '-'.join(str(v) for v in s.values()))
+def test_streamed_summary_matches_full_upload(make_bars, settings):
+    files = {'1D': csv_bytes(make_bars(300, 0, freq='D')), '4H': csv_bytes(make_bars(900, 1, freq='4h')),
+             '1H': csv_bytes(make_bars(3000, 2))}
+    full = MultiTimeframeSRFinder({timeframe: process_uploaded_file(io.BytesIO(content)) for timeframe, content in files.items()},
+                                  **settings)
+    expected = full.combine_multi_timeframe_levels()
+    assert streamed_finder(files, settings).combine_multi_timeframe_levels() == expected
+    assert streamed_finder(files, settings, round_trip=True).combine_multi_timeframe_levels() == expected
+
+
+@pytest.mark.parametrize('tick_size', [None, 0.01])
+def test_summary_bytes_round_trip(make_bars, tick_size):
+    summary = stream_csv_summary(io.BytesIO(csv_bytes(make_bars(3000, 3))), tick_size, chunksize=700)
+    restored = PriceSummary.from_bytes(summary.to_bytes())
+    assert (restored.tick_size, restored.bar_count) == (summary.tick_size, summary.bar_count) == (tick_size, 3000)
+    for column in PriceSummary.COLUMNS:
+        np.testing.assert_array_equal(restored.keys[column], summary.keys[column])
+        np.testing.assert_array_equal(restored.counts[column], summary.counts[column])
+    assert restored.recent_bars_frame().equals(summary.recent_bars_frame())